@@ -19,6 +19,7 @@ class TPCCKV(Experiment):
     DISTRICTS = Parameter(10)
     CLIENTS_PER_DISTRICT = Parameter(1)
     OPERATIONS = Parameter(100000)
+    LAYOUT = Parameter('normalized')
 
     # Environment
     CONSUS_HOST = Environment('localhost')
@@ -76,4 +77,5 @@ class TPCCKV(Experiment):
                               number=num_clients)
 
     def db_args(self):
-        return ('--host', self.CONSUS_HOST, '--port', self.CONSUS_PORT)
+        return ('--host', self.CONSUS_HOST, '--port', self.CONSUS_PORT,
+                '--layout', self.LAYOUT)
@@ -5,12 +5,15 @@ set -e
 WAREHOUSES=10
 DISTRICTS=10
 CLIENTS=100
+DURATION=60
+COORDINATOR=unix:tpcc-kv.sock
+ZYGOTE=unix:tpcc-kv-zygote.sock
 
-for c in `seq $CLIENTS`
-do
-    ./tpcc-kv run consus --output bench-${c}.dat --operations 1000 --warehouses $WAREHOUSES --districts $DISTRICTS &
-done
-for c in `seq $CLIENTS`
-do
-    wait
-done
+./tpcc-kv zygote --listen $ZYGOTE consus &
+ZYGOTE_PID=$!
+./tpcc-kv coordinate --listen $COORDINATOR --clients $CLIENTS --duration $DURATION &
+COORDINATOR_PID=$!
+# a failed spawn exits the script; do not leave these behind with their sockets
+trap 'kill $ZYGOTE_PID $COORDINATOR_PID 2>/dev/null || true' EXIT
+./tpcc-kv spawn --zygote $ZYGOTE --count $CLIENTS -- run consus --coordinator $COORDINATOR --output bench-{i}.dat --operations 0 --warehouses $WAREHOUSES --districts $DISTRICTS
+wait $COORDINATOR_PID
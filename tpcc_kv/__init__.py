@@ -2,9 +2,12 @@
 # All rights reserved.
 
 import abc
+import bisect
 import collections
+import functools
 import inspect
 import itertools
+import math
 import os
 import random
 import string
@@ -15,6 +18,15 @@ import argparse
 import importlib
 import ygor.collect
 
+import tpcc_kv.checkpoint
+import tpcc_kv.contention
+import tpcc_kv.coordinator
+import tpcc_kv.kvserver
+import tpcc_kv.metrics
+import tpcc_kv.profiling
+import tpcc_kv.sweep
+import tpcc_kv.zygote
+
 # This is a binding for running TPC-C on top of key-value stores.
 # It boils TPC-C down to loads and stores of objects.  Simply implement a
 # datastore that does get/put of the requested objects, the harness does the
@@ -51,11 +63,51 @@ ORDER_LINE_FIELDS = {'OL_O_ID', 'OL_D_ID', 'OL_W_ID', 'OL_NUMBER', 'OL_I_ID',
         'OL_DIST_INFO'}
 NEW_ORDER_FIELDS = {'NO_O_ID', 'NO_D_ID', 'NO_W_ID'}
 
+# How an order's lines are laid out in the store.  Normalized keeps one
+# ORDER_LINE record per line.  Embedded keeps the list of lines inside the
+# ORDER record under O_LINES.  Blob keeps the list in a single ORDER_LINES
+# record per order, keyed like the order.  The denormalized layouts read or
+# write all of an order's lines in one operation at the cost of larger values.
+LAYOUT_NORMALIZED = 'normalized'
+LAYOUT_EMBEDDED = 'embedded'
+LAYOUT_BLOB = 'blob'
+LAYOUTS = (LAYOUT_NORMALIZED, LAYOUT_EMBEDDED, LAYOUT_BLOB)
+ORDER_LINES_FIELD = 'O_LINES'
+
 class Database(object, metaclass=abc.ABCMeta):
 
+    # Layouts the binding can store, and the one in use.  Bindings that
+    # list LAYOUT_BLOB must implement _get_order_lines/_store_order_lines.
+    LAYOUTS = (LAYOUT_NORMALIZED,)
+    LAYOUT = LAYOUT_NORMALIZED
+
+    # Optional whole-transaction hooks for bindings that can run logic next to
+    # the data.  Each receives the inputs the harness generated (e.g.,
+    # NewOrderInputs), runs the entire transaction including commit (or the
+    # rollback NewOrderInputs.ROLLBACK asks for), and raises DatabaseAbort to
+    # be retried.  Left as None, the harness runs the transaction itself.
+    execute_new_order = None
+    execute_payment = None
+    execute_order_status = None
+    execute_stock_level = None
+
+    # Bindings that set ATOMIC implement _increment to add to numeric fields
+    # without conflicting with concurrent increments of the same record.  The
+    # others get a read-modify-write inside the current transaction.
+    ATOMIC = False
+
     def __init__(self):
         pass
 
+    def close(self):
+        '''called once the action is done with the database'''
+        pass
+
+    def sync(self):
+        '''return once every store so far is durable; loaders call this
+        before they checkpoint their progress'''
+        pass
+
     @abc.abstractmethod
     def begin_transaction(self):
         pass
@@ -68,57 +120,151 @@ class Database(object, metaclass=abc.ABCMeta):
     def abort_transaction(self):
         pass
 
-    def get_warehouse(self, key):
-        warehouse = self._get_warehouse(key)
-        assert set(warehouse.keys()).issuperset(WAREHOUSE_FIELDS)
-        return warehouse
+    # The get_* and store_* calls take an optional projection, fields.  A
+    # get returns at least those fields; a store writes only those fields of
+    # the record passed in.  Bindings that set PROJECTION implement
+    # _get_fields/_update_fields to move just the projected fields.  For the
+    # others the projection is advisory: gets return, and stores must be
+    # passed, the whole record.
+    PROJECTION = False
+
+    # Bindings that set PREFETCH implement _prefetch, which is told about the
+    # gets a transaction is about to make, as (space, key, fields), so that it
+    # can fetch them together, e.g. in one round trip.  The harness still
+    # makes every one of those gets afterwards.
+    PREFETCH = False
+
+    def prefetch(self, reads):
+        if self.PREFETCH:
+            self._prefetch(reads)
+
+    def prefetch_orders_with_lines(self, keys):
+        '''prefetch what get_order_with_lines reads for each of keys'''
+        if not self.PREFETCH:
+            return
+        reads = [('ORDER', key, None) for key in keys]
+        if self.LAYOUT == LAYOUT_BLOB:
+            reads += [('ORDER_LINES', key, None) for key in keys]
+        self._prefetch(reads)
+        if self.LAYOUT == LAYOUT_NORMALIZED:
+            # which lines exist depends on the orders just fetched
+            reads = []
+            for key in keys:
+                order = self.get_order(key, fields=('O_OL_CNT',))
+                if order is not None:
+                    reads += [('ORDER_LINE', OrderLineKey(W_ID=key.W_ID, D_ID=key.D_ID,
+                                                          O_ID=key.O_ID, OL_NUMBER=ol), None)
+                              for ol in range(1, order['O_OL_CNT'] + 1)]
+            self._prefetch(reads)
+
+    def _prefetch(self, reads):
+        raise NotImplementedError('binding sets PREFETCH but does not implement _prefetch')
+
+    def _get_record(self, get, space, schema, key, fields):
+        if fields is None or not self.PROJECTION:
+            record = get(key)
+            assert record is None or set(record.keys()).issuperset(schema)
+            return record
+        assert schema.issuperset(fields)
+        record = self._get_fields(space, key, fields)
+        assert record is None or set(record.keys()).issuperset(fields)
+        return record
+
+    def _store_record(self, store, space, schema, key, record, fields):
+        if fields is None or not self.PROJECTION:
+            assert set(record.keys()).issuperset(schema)
+            return store(key, record)
+        assert schema.issuperset(fields)
+        return self._update_fields(space, key, {f: record[f] for f in fields})
+
+    def _get_fields(self, space, key, fields):
+        raise NotImplementedError('binding sets PROJECTION but does not implement _get_fields')
+
+    def _update_fields(self, space, key, values):
+        raise NotImplementedError('binding sets PROJECTION but does not implement _update_fields')
+
+    def get_warehouse(self, key, fields=None):
+        return self._get_record(self._get_warehouse, 'WAREHOUSE', WAREHOUSE_FIELDS, key, fields)
 
     @abc.abstractmethod
     def _get_warehouse(self, key):
         pass
 
-    def store_warehouse(self, key, warehouse):
-        assert set(warehouse.keys()).issuperset(WAREHOUSE_FIELDS)
-        return self._store_warehouse(key, warehouse)
+    def store_warehouse(self, key, warehouse, fields=None):
+        return self._store_record(self._store_warehouse, 'WAREHOUSE', WAREHOUSE_FIELDS, key, warehouse, fields)
 
     @abc.abstractmethod
     def _store_warehouse(self, key, warehouse):
         pass
 
-    def get_district(self, key):
-        district = self._get_district(key)
-        assert set(district.keys()).issuperset(DISTRICT_FIELDS)
-        return district
+    def get_district(self, key, fields=None):
+        return self._get_record(self._get_district, 'DISTRICT', DISTRICT_FIELDS, key, fields)
 
     @abc.abstractmethod
     def _get_district(self, key):
         pass
 
-    def store_district(self, key, district):
-        assert set(district.keys()).issuperset(DISTRICT_FIELDS)
-        return self._store_district(key, district)
+    def store_district(self, key, district, fields=None):
+        return self._store_record(self._store_district, 'DISTRICT', DISTRICT_FIELDS, key, district, fields)
 
     @abc.abstractmethod
     def _store_district(self, key, district):
         pass
 
-    def get_customer(self, key):
-        customer = self._get_customer(key)
-        assert set(customer.keys()).issuperset(CUSTOMER_FIELDS)
-        return customer
+    def get_customer(self, key, fields=None):
+        return self._get_record(self._get_customer, 'CUSTOMER', CUSTOMER_FIELDS, key, fields)
 
     @abc.abstractmethod
     def _get_customer(self, key):
         pass
 
-    def store_customer(self, key, customer):
-        assert set(customer.keys()).issuperset(CUSTOMER_FIELDS)
-        return self._store_customer(key, customer)
+    def store_customer(self, key, customer, fields=None):
+        return self._store_record(self._store_customer, 'CUSTOMER', CUSTOMER_FIELDS, key, customer, fields)
 
     @abc.abstractmethod
     def _store_customer(self, key, customer):
         pass
 
+    def increment_warehouse(self, key, deltas, current=None):
+        return self._apply_increment(self.get_warehouse, self.store_warehouse,
+                                     'WAREHOUSE', key, deltas, current)
+
+    def increment_district(self, key, deltas, current=None):
+        return self._apply_increment(self.get_district, self.store_district,
+                                     'DISTRICT', key, deltas, current)
+
+    def increment_customer(self, key, deltas, current=None):
+        return self._apply_increment(self.get_customer, self.store_customer,
+                                     'CUSTOMER', key, deltas, current)
+
+    def increment_stock(self, key, deltas, current=None):
+        return self._apply_increment(self.get_stock, self.store_stock,
+                                     'STOCK', key, deltas, current)
+
+    def _apply_increment(self, get, store, space, key, deltas, current):
+        '''add each of deltas to its field of the record at key and return
+        the values of those fields before the increment (fetch-and-add).
+
+        Callers that already read the record pass it as current; it saves the
+        read-modify-write a read and is updated to match the store.'''
+        if self.ATOMIC:
+            before = self._increment(space, key, deltas)
+            if current is not None:
+                for field, delta in deltas.items():
+                    current[field] = before[field] + delta
+            return before
+        fields = tuple(deltas)
+        record = current if current is not None else get(key, fields=fields)
+        before = {}
+        for field, delta in deltas.items():
+            before[field] = record[field]
+            record[field] += delta
+        store(key, record, fields=fields)
+        return before
+
+    def _increment(self, space, key, deltas):
+        raise NotImplementedError('binding sets ATOMIC but does not implement _increment')
+
     def store_new_order(self, key, new_order):
         assert set(new_order.keys()).issuperset(NEW_ORDER_FIELDS)
         return self._store_new_order(key, new_order)
@@ -127,69 +273,102 @@ class Database(object, metaclass=abc.ABCMeta):
     def _store_new_order(self, key, new_order):
         pass
 
-    def get_order(self, key):
-        order = self._get_order(key)
-        assert set(order.keys()).issuperset(ORDER_FIELDS)
-        return order
+    def get_order(self, key, fields=None):
+        return self._get_record(self._get_order, 'ORDER', ORDER_FIELDS, key, fields)
 
     @abc.abstractmethod
     def _get_order(self, key):
         pass
 
-    def store_order(self, key, order):
-        assert set(order.keys()).issuperset(ORDER_FIELDS)
-        return self._store_order(key, order)
+    def store_order(self, key, order, fields=None):
+        return self._store_record(self._store_order, 'ORDER', ORDER_FIELDS, key, order, fields)
 
     @abc.abstractmethod
     def _store_order(self, key, order):
         pass
 
-    def get_order_line(self, key):
-        order_line = self._get_order_line(key)
-        assert set(order_line.keys()).issuperset(ORDER_LINE_FIELDS)
-        return order_line
+    def get_order_line(self, key, fields=None):
+        return self._get_record(self._get_order_line, 'ORDER_LINE', ORDER_LINE_FIELDS, key, fields)
 
     @abc.abstractmethod
     def _get_order_line(self, key):
         pass
 
-    def store_order_line(self, key, order_line):
-        assert set(order_line.keys()).issuperset(ORDER_LINE_FIELDS)
-        return self._store_order_line(key, order_line)
+    def store_order_line(self, key, order_line, fields=None):
+        return self._store_record(self._store_order_line, 'ORDER_LINE', ORDER_LINE_FIELDS, key, order_line, fields)
 
     @abc.abstractmethod
     def _store_order_line(self, key, order_line):
         pass
 
-    def get_item(self, key):
-        item = self._get_item(key)
-        assert set(item.keys()).issuperset(ITEM_FIELDS)
-        return item
+    def get_order_with_lines(self, key):
+        '''return the order at key and its lines in OL_NUMBER order; lines
+        that do not exist are None, and a missing order has no lines'''
+        order = self.get_order(key)
+        if order is None:
+            return None, []
+        if self.LAYOUT == LAYOUT_NORMALIZED:
+            order_lines = []
+            for ol in range(1, order['O_OL_CNT'] + 1):
+                order_line_key = OrderLineKey(W_ID=key.W_ID, D_ID=key.D_ID,
+                                              O_ID=key.O_ID, OL_NUMBER=ol)
+                order_lines.append(self.get_order_line(order_line_key))
+            return order, order_lines
+        if self.LAYOUT == LAYOUT_EMBEDDED:
+            order_lines = order[ORDER_LINES_FIELD]
+        else:
+            order_lines = self._get_order_lines(key) or []
+        for order_line in order_lines:
+            assert set(order_line.keys()).issuperset(ORDER_LINE_FIELDS)
+        return order, order_lines
+
+    def store_order_with_lines(self, key, order, order_lines):
+        if self.LAYOUT == LAYOUT_EMBEDDED:
+            for order_line in order_lines:
+                assert set(order_line.keys()).issuperset(ORDER_LINE_FIELDS)
+            order = dict(order)
+            order[ORDER_LINES_FIELD] = order_lines
+            return self.store_order(key, order)
+        self.store_order(key, order)
+        if self.LAYOUT == LAYOUT_BLOB:
+            for order_line in order_lines:
+                assert set(order_line.keys()).issuperset(ORDER_LINE_FIELDS)
+            return self._store_order_lines(key, order_lines)
+        for order_line in order_lines:
+            order_line_key = OrderLineKey(W_ID=key.W_ID, D_ID=key.D_ID,
+                                          O_ID=key.O_ID,
+                                          OL_NUMBER=order_line['OL_NUMBER'])
+            self.store_order_line(order_line_key, order_line)
+
+    def _get_order_lines(self, key):
+        raise NotImplementedError('binding does not implement LAYOUT_BLOB')
+
+    def _store_order_lines(self, key, order_lines):
+        raise NotImplementedError('binding does not implement LAYOUT_BLOB')
+
+    def get_item(self, key, fields=None):
+        return self._get_record(self._get_item, 'ITEM', ITEM_FIELDS, key, fields)
 
     @abc.abstractmethod
     def _get_item(self, key):
         pass
 
-    def store_item(self, key, item):
-        assert set(item.keys()).issuperset(ITEM_FIELDS)
-        return self._store_item(key, item)
+    def store_item(self, key, item, fields=None):
+        return self._store_record(self._store_item, 'ITEM', ITEM_FIELDS, key, item, fields)
 
     @abc.abstractmethod
     def _store_item(self, key, item):
         pass
 
-    def get_stock(self, key):
-        stock = self._get_stock(key)
-        assert set(stock.keys()).issuperset(STOCK_FIELDS)
-        return stock
+    def get_stock(self, key, fields=None):
+        return self._get_record(self._get_stock, 'STOCK', STOCK_FIELDS, key, fields)
 
     @abc.abstractmethod
     def _get_stock(self, key):
         pass
 
-    def store_stock(self, key, stock):
-        assert set(stock.keys()).issuperset(STOCK_FIELDS)
-        return self._store_stock(key, stock)
+    def store_stock(self, key, stock, fields=None):
+        return self._store_record(self._store_stock, 'STOCK', STOCK_FIELDS, key, stock, fields)
 
     @abc.abstractmethod
     def _store_stock(self, key, stock):
@@ -211,8 +390,10 @@ class DatabaseAbort(Exception): pass
 C = 0
 CHARSET_A = string.ascii_letters + string.digits
 
-def NURand(A, x, y):
-    return (((random.randint(0, A) | random.randint(x, y)) + C) % (y - x + 1)) + x
+def NURand(A, x, y, c=None):
+    if c is None:
+        c = C
+    return (((random.randint(0, A) | random.randint(x, y)) + c) % (y - x + 1)) + x
 
 def random_a_string(x, y):
     sz = random.randint(x, y)
@@ -244,6 +425,25 @@ ItemKey = collections.namedtuple('ItemKey', ('I_ID',))
 StockKey = collections.namedtuple('StockKey', ('I_ID', 'W_ID'))
 HistoryKey = collections.namedtuple('HistoryKey', ('C_ID', 'D_ID', 'W_ID'))
 
+# The randomly generated inputs of each transaction.  These are what a
+# binding's execute_* hooks receive.
+NewOrderInputs = collections.namedtuple('NewOrderInputs', ('W_ID', 'D_ID', 'C_ID', 'O_ENTRY_D', 'ORDER_LINES', 'ROLLBACK'))
+OrderLineInputs = collections.namedtuple('OrderLineInputs', ('OL_I_ID', 'OL_SUPPLY_W_ID', 'OL_QUANTITY'))
+PaymentInputs = collections.namedtuple('PaymentInputs', ('W_ID', 'D_ID', 'C_ID', 'C_W_ID', 'C_D_ID', 'H_AMOUNT', 'H_DATE'))
+OrderStatusInputs = collections.namedtuple('OrderStatusInputs', ('W_ID', 'D_ID', 'C_ID'))
+StockLevelInputs = collections.namedtuple('StockLevelInputs', ('W_ID', 'D_ID', 'THRESHOLD'))
+
+TRANSACTIONS = ('new-order', 'payment', 'order-status', 'stock-level')
+# Which side of the wire ran a transaction: the harness, with get/store calls,
+# or the binding, through one of its execute_* hooks
+PATH_CLIENT = 'client'
+PATH_PROCEDURE = 'procedure'
+
+def series_label(series, path):
+    if path == PATH_PROCEDURE:
+        return series + '-procedure'
+    return series
+
 class Parameters(object):
 
     def __init__(self, W, D=10):
@@ -253,6 +453,12 @@ class Parameters(object):
         self.ORDER     = 30000
         self.ITEMS     = 100000
         self.STOCK     = 100000
+        # Workload knobs; the defaults are the TPC-C values
+        self.MIX = (10, 10, 1, 1) # new-order, payment, order-status, stock-level
+        self.NURAND_C = C
+        self.REMOTE_ORDER_LINE_PCT = 1.0
+        self.REMOTE_PAYMENT_PCT = 15.0
+        self.ZIPF_THETA = 0.0
 
     @property
     def CUSTOMER_PER_DISTRICT(self):
@@ -262,11 +468,30 @@ class Parameters(object):
     def NEW_ORDER_THRESHOLD(self):
         return self.CUSTOMER_PER_DISTRICT - 900 + 1
 
+class ZipfChooser(object):
+    '''draw from 1..n with P(k) proportional to 1 / k**theta'''
+
+    def __init__(self, n, theta):
+        self.n = n
+        self.cumulative = list(itertools.accumulate(1.0 / k ** theta for k in range(1, n + 1)))
+
+    def __call__(self):
+        x = random.random() * self.cumulative[-1]
+        return min(bisect.bisect_right(self.cumulative, x) + 1, self.n)
+
+def parse_mix(s):
+    '''parse "NO,P,OS,SL" into a tuple of four non-negative weights'''
+    mix = tuple(int(x) for x in s.split(','))
+    if len(mix) != 4 or min(mix) < 0 or sum(mix) == 0:
+        raise argparse.ArgumentTypeError('expected four non-negative weights, e.g. 10,10,1,1')
+    return mix
+
 class PopulationGenerator(object):
 
-    def __init__(self, db, params):
+    def __init__(self, db, params, progress=None):
         self.db = db
         self.params = params
+        self.progress = progress or tpcc_kv.checkpoint.LoadProgress(db)
 
     def generate_item(self, item_id):
         return {'I_ID': item_id,
@@ -386,52 +611,77 @@ class PopulationGenerator(object):
                 'NO_W_ID': warehouse_id}
 
     def load_items(self):
-        for i in range(1, self.params.ITEMS + 1):
+        items = self.progress.table('items', 'ITEM', self.params.ITEMS)
+        for i in items.remaining():
             item = self.generate_item(i)
             item_key = ItemKey(I_ID=item['I_ID'])
             self.db.store_item(item_key, item)
+            items.advance(i)
+        self.progress.finish(items)
 
     def load_warehouse(self, warehouse_id):
         '''load all rows that are unique to warehouse_id, but not predicated
         upon any one district within warehouse_id'''
         w = warehouse_id
-        warehouse_key = WarehouseKey(W_ID=w)
-        warehouse = self.generate_warehouse(w)
-        self.db.store_warehouse(warehouse_key, warehouse)
-        for s in range(1, self.params.STOCK + 1):
+        unit = 'warehouse-%d' % w
+        warehouses = self.progress.table(unit, 'WAREHOUSE', 1, warehouse=w)
+        for row in warehouses.remaining():
+            warehouse_key = WarehouseKey(W_ID=w)
+            warehouse = self.generate_warehouse(w)
+            self.db.store_warehouse(warehouse_key, warehouse)
+            warehouses.advance(row)
+        self.progress.finish(warehouses)
+        stocks = self.progress.table(unit, 'STOCK', self.params.STOCK, warehouse=w)
+        for s in stocks.remaining():
             stock = self.generate_stock(w, s)
             stock_key = StockKey(W_ID=stock['S_W_ID'], I_ID=stock['S_I_ID'])
             self.db.store_stock(stock_key, stock)
+            stocks.advance(s)
+        self.progress.finish(stocks)
 
     def load_district(self, warehouse_id, district_id):
         '''load all rows that are unique to (warehouse_id, district_id)'''
         w = warehouse_id
         d = district_id
-        district_key = DistrictKey(W_ID=w, D_ID=d)
-        district = self.generate_district(w, d)
-        self.db.store_district(district_key, district)
-        for c in range(1, self.params.CUSTOMER_PER_DISTRICT + 1):
+        unit = 'district-%d-%d' % (w, d)
+        districts = self.progress.table(unit, 'DISTRICT', 1, warehouse=w, district=d)
+        for row in districts.remaining():
+            district_key = DistrictKey(W_ID=w, D_ID=d)
+            district = self.generate_district(w, d)
+            self.db.store_district(district_key, district)
+            districts.advance(row)
+        self.progress.finish(districts)
+        customers = self.progress.table(unit, 'CUSTOMER', self.params.CUSTOMER_PER_DISTRICT, warehouse=w, district=d)
+        for c in customers.remaining():
             customer_key = CustomerKey(W_ID=w, D_ID=d, C_ID=c)
             customer = self.generate_customer(w, d, c)
             self.db.store_customer(customer_key, customer)
             history_key = HistoryKey(W_ID=w, D_ID=d, C_ID=c)
             history = self.generate_history(w, d, c)
             self.db.store_history(history_key, history)
+            customers.advance(c)
+        self.progress.finish(customers)
+        # a resumed load must give each remaining order the customer it would
+        # have had, so the permutation comes from a seed kept with the unit
+        state = self.progress.unit(unit)
+        if 'customer_permutation_seed' not in state:
+            state['customer_permutation_seed'] = random.getrandbits(64)
         customer_permutation = list(range(1, self.params.CUSTOMER_PER_DISTRICT + 1))
-        random.shuffle(customer_permutation)
-        for o in range(1, self.params.CUSTOMER_PER_DISTRICT + 1):
+        random.Random(state['customer_permutation_seed']).shuffle(customer_permutation)
+        orders = self.progress.table(unit, 'ORDER', self.params.CUSTOMER_PER_DISTRICT, warehouse=w, district=d)
+        for o in orders.remaining():
             c = customer_permutation[o - 1]
             order_key = OrderKey(W_ID=w, D_ID=d, O_ID=o)
             order = self.generate_order(w, d, o, c)
-            self.db.store_order(order_key, order)
-            for ol in range(1, order['O_OL_CNT'] + 1):
-                order_line_key = OrderLineKey(W_ID=w, D_ID=d, O_ID=o, OL_NUMBER=ol)
-                order_line = self.generate_order_line(w, d, o, ol)
-                self.db.store_order_line(order_line_key, order_line)
+            order_lines = [self.generate_order_line(w, d, o, ol)
+                           for ol in range(1, order['O_OL_CNT'] + 1)]
+            self.db.store_order_with_lines(order_key, order, order_lines)
             if o >= self.params.NEW_ORDER_THRESHOLD:
                 new_order_key = NewOrderKey(W_ID=w, D_ID=d, O_ID=o)
                 new_order = self.generate_new_order(w, d, o)
                 self.db.store_new_order(new_order_key, new_order)
+            orders.advance(o)
+        self.progress.finish(orders)
 
     def load_all(self):
         self.load_items()
@@ -444,103 +694,148 @@ class PopulationGenerator(object):
 
 class TransactionGenerator(object):
 
-    def __init__(self, db, params, num_ops, new_order_only):
+    def __init__(self, db, params, num_ops, new_order_only, tracker=None, metrics=None, stop=None, summary=None):
         self.db = db
         self.params = params
         self.num_ops = num_ops
         self.new_order_only = new_order_only
+        self.tracker = tracker
+        self.metrics = metrics
+        self.stop = stop
+        self.summary = summary
+        self.completed = 0
+        self.choose_W_ID = None
+        self.choose_D_ID = None
+        if params.ZIPF_THETA > 0:
+            self.choose_W_ID = ZipfChooser(params.WAREHOUSE, params.ZIPF_THETA)
+            self.choose_D_ID = ZipfChooser(params.DISTRICT, params.ZIPF_THETA)
 
     def generate_W_ID(self):
+        if self.choose_W_ID is not None:
+            return self.choose_W_ID()
         return random.randint(1, self.params.WAREHOUSE)
 
     def generate_D_ID(self):
+        if self.choose_D_ID is not None:
+            return self.choose_D_ID()
         return random.randint(1, self.params.DISTRICT)
 
+    def generate_C_ID(self):
+        return NURand(1023, 1, self.params.CUSTOMER_PER_DISTRICT, self.params.NURAND_C)
+
+    def new_order_inputs(self, W_ID, D_ID):
+        order_lines = []
+        for i in range(random.randint(1, 10)):
+            supply_W_ID = W_ID
+            if random.random() * 100 < self.params.REMOTE_ORDER_LINE_PCT:
+                while supply_W_ID == W_ID and self.params.WAREHOUSE > 1:
+                    supply_W_ID = self.generate_W_ID()
+            order_lines.append(OrderLineInputs(
+                OL_I_ID=NURand(8191, 1, self.params.ITEMS, self.params.NURAND_C),
+                OL_SUPPLY_W_ID=supply_W_ID,
+                OL_QUANTITY=random.randint(1, 10)))
+        return NewOrderInputs(W_ID=W_ID, D_ID=D_ID, C_ID=self.generate_C_ID(),
+                O_ENTRY_D=int(time.time() * 2**32),
+                ORDER_LINES=tuple(order_lines),
+                # this is the 1% random rollback
+                ROLLBACK=random.randint(1, 100) == 1)
+
     def new_order_transaction(self, W_ID, D_ID):
-        C_ID = NURand(1023, 1, self.params.CUSTOMER_PER_DISTRICT)
+        return self.dispatch(self.db.execute_new_order, self.new_order_body,
+                             self.new_order_inputs(W_ID, D_ID))
+
+    def new_order_body(self, inputs):
+        W_ID, D_ID, C_ID = inputs.W_ID, inputs.D_ID, inputs.C_ID
         self.db.begin_transaction()
         warehouse_key = WarehouseKey(W_ID=W_ID)
-        warehouse = self.db.get_warehouse(warehouse_key)
+        warehouse = self.db.get_warehouse(warehouse_key, fields=('W_TAX',))
         district_key = DistrictKey(W_ID=W_ID, D_ID=D_ID)
-        district = self.db.get_district(district_key)
-        order_id = district['D_NEXT_O_ID']
-        district['D_NEXT_O_ID'] += 1
-        self.db.store_district(district_key, district)
+        order_id = self.db.increment_district(district_key, {'D_NEXT_O_ID': 1})['D_NEXT_O_ID']
         customer_key = CustomerKey(W_ID=W_ID, D_ID=D_ID, C_ID=C_ID)
-        customer = self.db.get_customer(customer_key)
+        customer = self.db.get_customer(customer_key, fields=('C_DISCOUNT', 'C_LAST', 'C_CREDIT'))
         customer['C_O_ID'] = order_id
-        self.db.store_customer(customer_key, customer)
+        self.db.store_customer(customer_key, customer, fields=('C_O_ID',))
         new_order_key = NewOrderKey(W_ID=W_ID, D_ID=D_ID, O_ID=order_id)
         new_order = {'NO_O_ID': order_id,
                      'NO_D_ID': D_ID,
                      'NO_W_ID': W_ID}
         self.db.store_new_order(new_order_key, new_order)
-        ordered_items = random.randint(1, 10)
         order = {'O_ID': order_id,
                  'O_D_ID': D_ID,
                  'O_W_ID': W_ID,
                  'O_C_ID': C_ID,
-                 'O_ENTRY_D': int(time.time() * 2**32),
+                 'O_ENTRY_D': inputs.O_ENTRY_D,
                  'O_CARRIER_ID': 0,
-                 'O_OL_CNT': ordered_items,
+                 'O_OL_CNT': len(inputs.ORDER_LINES),
                  'O_ALL_LOCAL': 1}
+        S_DIST_xx = 'S_DIST_%02d' % (((D_ID - 1) % 10) + 1) # XXX
+        stock_fields = ('S_QUANTITY', S_DIST_xx, 'S_DATA')
+        if not self.db.ATOMIC:
+            stock_fields += ('S_YTD', 'S_ORDER_CNT', 'S_REMOTE_CNT')
+        self.db.prefetch([('ITEM', ItemKey(line.OL_I_ID), None) for line in inputs.ORDER_LINES] +
+                         [('STOCK', StockKey(I_ID=line.OL_I_ID, W_ID=W_ID), stock_fields)
+                          for line in inputs.ORDER_LINES])
         order_lines = []
-        for i in range(ordered_items):
-            order_line = {'OL_I_ID': NURand(8191, 1, self.params.ITEMS),
-                          'OL_SUPPLY_W_ID': W_ID,
-                          'OL_DELIVERY_D': 0,
-                          'OL_D_ID': D_ID,
-                          'OL_W_ID': W_ID,
-                          'OL_QUANTITY': random.randint(1, 10)}
-            if random.randint(1, 100) == 1:
+        for i, line in enumerate(inputs.ORDER_LINES):
+            if line.OL_SUPPLY_W_ID != W_ID:
                 order['O_ALL_LOCAL'] = 0
-                while order_line['OL_SUPPLY_W_ID'] == W_ID and self.params.WAREHOUSE > 1:
-                    order_line['OL_SUPPLY_W_ID'] = self.generate_W_ID()
-            order_lines.append(order_line)
-        # this is the 1% random rollback
-        rollback_case = random.randint(1, 100) == 1
-        order_key = OrderKey(W_ID=W_ID, D_ID=D_ID, O_ID=order_id)
-        self.db.store_order(order_key, order)
-        for i, order_line in enumerate(order_lines):
-            item = self.db.get_item(ItemKey(order_line['OL_I_ID']))
+            item = self.db.get_item(ItemKey(line.OL_I_ID))
             stock_key = StockKey(I_ID=item['I_ID'], W_ID=W_ID)
-            stock = self.db.get_stock(stock_key)
-            if stock['S_QUANTITY'] >= order_line['OL_QUANTITY'] + 10:
-                stock['S_QUANTITY'] = stock['S_QUANTITY'] - order_line['OL_QUANTITY']
-            else:
-                stock['S_QUANTITY'] = (stock['S_QUANTITY'] - order_line['OL_QUANTITY']) + 91
-            stock['S_YTD'] = stock['S_YTD'] + order_line['OL_QUANTITY']
-            stock['S_ORDER_CNT'] = stock['S_ORDER_CNT'] + 1
-            if order_line['OL_SUPPLY_W_ID'] != W_ID:
-                stock['S_REMOTE_CNT'] = stock['S_REMOTE_CNT'] + 1
-            self.db.store_stock(stock_key, stock)
-            order_line['OL_AMOUNT'] = order_line['OL_QUANTITY'] * item['I_PRICE']
-            if 'ORIGINAL' in item['I_DATA'] and 'ORIGINAL' in item['S_DATA']:
+            stock = self.db.get_stock(stock_key, fields=stock_fields)
+            # S_QUANTITY's delta depends on the value read; with ATOMIC it is
+            # applied as an increment like the counters
+            quantity = -line.OL_QUANTITY
+            if stock['S_QUANTITY'] < line.OL_QUANTITY + 10:
+                quantity += 91
+            self.db.increment_stock(stock_key,
+                    {'S_QUANTITY': quantity,
+                     'S_YTD': line.OL_QUANTITY,
+                     'S_ORDER_CNT': 1,
+                     'S_REMOTE_CNT': 1 if line.OL_SUPPLY_W_ID != W_ID else 0},
+                    current=stock)
+            if 'ORIGINAL' in item['I_DATA'] and 'ORIGINAL' in stock['S_DATA']:
                 brand_generic = 'B'
             else:
                 brand_generic = 'G'
-            order_line['OL_NUMBER'] = i + 1
-            order_line['OL_O_ID'] = order_id
-            order_line['OL_DIST_INFO'] = stock['S_DIST_%02d' % (((D_ID - 1) % 10) + 1)] # XXX
-            order_line_key = OrderLineKey(W_ID=W_ID, D_ID=D_ID, O_ID=order_id,
-                    OL_NUMBER = i + 1)
-            self.db.store_order_line(order_line_key, order_line)
-        if rollback_case:
+            order_lines.append({'OL_O_ID': order_id,
+                                'OL_D_ID': D_ID,
+                                'OL_W_ID': W_ID,
+                                'OL_NUMBER': i + 1,
+                                'OL_I_ID': line.OL_I_ID,
+                                'OL_SUPPLY_W_ID': line.OL_SUPPLY_W_ID,
+                                'OL_DELIVERY_D': 0,
+                                'OL_QUANTITY': line.OL_QUANTITY,
+                                'OL_AMOUNT': line.OL_QUANTITY * item['I_PRICE'],
+                                'OL_DIST_INFO': stock[S_DIST_xx]})
+        order_key = OrderKey(W_ID=W_ID, D_ID=D_ID, O_ID=order_id)
+        self.db.store_order_with_lines(order_key, order, order_lines)
+        if inputs.ROLLBACK:
             self.db.abort_transaction()
         else:
             self.db.commit_transaction()
 
-    def payment_transaction(self, W_ID, D_ID):
-        C_ID = NURand(1023, 1, self.params.CUSTOMER_PER_DISTRICT)
+    def payment_inputs(self, W_ID, D_ID):
         C_W_ID = W_ID
         C_D_ID = D_ID
-        if random.randint(1, 100) >= 85:
+        if random.random() * 100 < self.params.REMOTE_PAYMENT_PCT:
             C_D_ID = self.generate_D_ID()
             while C_W_ID == W_ID and self.params.WAREHOUSE > 1:
                 C_W_ID = self.generate_W_ID()
-        pay_amount = random.randint(100, 500000)
+        return PaymentInputs(W_ID=W_ID, D_ID=D_ID, C_ID=self.generate_C_ID(),
+                C_W_ID=C_W_ID, C_D_ID=C_D_ID,
+                H_AMOUNT=random.randint(100, 500000),
+                H_DATE=int(time.time() * 2**32))
+
+    def payment_transaction(self, W_ID, D_ID):
+        return self.dispatch(self.db.execute_payment, self.payment_body,
+                             self.payment_inputs(W_ID, D_ID))
+
+    def payment_body(self, inputs):
+        W_ID, D_ID, C_ID = inputs.W_ID, inputs.D_ID, inputs.C_ID
+        C_W_ID, C_D_ID = inputs.C_W_ID, inputs.C_D_ID
+        pay_amount = inputs.H_AMOUNT
         history = {'H_AMOUNT': pay_amount,
-                   'H_DATE': int(time.time() * 2**32),
+                   'H_DATE': inputs.H_DATE,
                    'H_C_D_ID': C_D_ID,
                    'H_C_W_ID': C_W_ID,
                    'H_D_ID': D_ID,
@@ -551,82 +846,112 @@ class TransactionGenerator(object):
         warehouse_fields = ('W_NAME', 'W_STREET_1', 'W_STREET_2', 'W_CITY', 'W_STATE', 'W_ZIP')
         if not self.db.ATOMIC:
             warehouse_fields += ('W_YTD',)
-        warehouse = self.db.get_warehouse(warehouse_key)
-        if self.db.ATOMIC:
-            self.db.bump_warehouse_payment(warehouse_key, pay_amount)
-        else:
-            warehouse['W_YTD'] += pay_amount
-            self.db.store_warehouse(warehouse_key, warehouse)
+        warehouse = self.db.get_warehouse(warehouse_key, fields=warehouse_fields)
+        self.db.increment_warehouse(warehouse_key, {'W_YTD': pay_amount}, current=warehouse)
         district_key = DistrictKey(W_ID=W_ID, D_ID=D_ID)
         district_fields = ('D_NAME', 'D_STREET_1', 'D_STREET_2', 'D_CITY', 'D_STATE', 'D_ZIP')
         if not self.db.ATOMIC:
             district_fields += ('D_YTD',)
-        district = self.db.get_district(district_key)
-        if self.db.ATOMIC:
-            self.db.bump_district_payment(district_key, pay_amount)
-        else:
-            district['D_YTD'] += pay_amount
-            self.db.store_district(district_key, district)
+        district = self.db.get_district(district_key, fields=district_fields)
+        self.db.increment_district(district_key, {'D_YTD': pay_amount}, current=district)
         customer_key = CustomerKey(W_ID=C_W_ID, D_ID=C_D_ID, C_ID=C_ID)
-        customer = self.db.get_customer(customer_key)
-        customer.update({'C_BALANCE': customer['C_BALANCE'] - pay_amount,
-                         'C_YTD_PAYMENT': customer['C_YTD_PAYMENT'] + pay_amount,
-                         'C_PAYMENT_CNT': customer['C_PAYMENT_CNT'] + 1})
+        # C_DATA is 300-500 bytes and only needed for bad credit
+        customer_fields = ('C_FIRST', 'C_MIDDLE', 'C_LAST', 'C_STREET_1',
+                'C_STREET_2', 'C_CITY', 'C_STATE', 'C_ZIP', 'C_PHONE',
+                'C_SINCE', 'C_CREDIT', 'C_CREDIT_LIM', 'C_DISCOUNT',
+                'C_BALANCE', 'C_YTD_PAYMENT', 'C_PAYMENT_CNT')
+        customer = self.db.get_customer(customer_key, fields=customer_fields)
+        deltas = {'C_BALANCE': -pay_amount,
+                  'C_YTD_PAYMENT': pay_amount,
+                  'C_PAYMENT_CNT': 1}
         if customer['C_CREDIT'] == 'BC':
+            if 'C_DATA' not in customer:
+                customer.update(self.db.get_customer(customer_key, fields=('C_DATA',)))
+            # C_DATA is rewritten anyway, so write the counters with it
+            for field, delta in deltas.items():
+                customer[field] += delta
             customer['C_DATA'] = str((C_ID, C_D_ID, C_W_ID, D_ID, W_ID, pay_amount)) + customer['C_DATA']
             customer['C_DATA'] = customer['C_DATA'][:500]
-        self.db.store_customer(customer_key, customer)
+            self.db.store_customer(customer_key, customer, fields=tuple(deltas) + ('C_DATA',))
+        else:
+            self.db.increment_customer(customer_key, deltas, current=customer)
         history['H_DATA'] = warehouse['W_NAME'] + ' '*4 + district['D_NAME']
         history_key = HistoryKey(W_ID=C_W_ID, D_ID=C_D_ID, C_ID=C_ID)
         self.db.store_history(history_key, history)
         self.db.commit_transaction()
 
+    def order_status_inputs(self, W_ID, D_ID):
+        return OrderStatusInputs(W_ID=W_ID, D_ID=D_ID, C_ID=self.generate_C_ID())
+
     def order_status_transaction(self, W_ID, D_ID):
-        C_ID = NURand(1023, 1, self.params.CUSTOMER_PER_DISTRICT)
+        return self.dispatch(self.db.execute_order_status, self.order_status_body,
+                             self.order_status_inputs(W_ID, D_ID))
+
+    def order_status_body(self, inputs):
+        W_ID, D_ID, C_ID = inputs.W_ID, inputs.D_ID, inputs.C_ID
         self.db.begin_transaction()
         customer_key = CustomerKey(W_ID=W_ID, D_ID=D_ID, C_ID=C_ID)
-        customer = self.db.get_customer(customer_key)
+        customer = self.db.get_customer(customer_key,
+                fields=('C_BALANCE', 'C_FIRST', 'C_MIDDLE', 'C_LAST', 'C_O_ID'))
         order_key = OrderKey(W_ID=W_ID, D_ID=D_ID, O_ID=customer['C_O_ID'])
-        order = self.db.get_order(order_key)
-        for i in range(1, order['O_OL_CNT'] + 1):
-            order_line_key = OrderLineKey(W_ID=W_ID, D_ID=D_ID,
-                                          O_ID=customer['C_O_ID'],
-                                          OL_NUMBER=i)
-            order_line = self.db.get_order_line(order_line_key)
+        order, order_lines = self.db.get_order_with_lines(order_key)
         self.db.commit_transaction()
 
+    def stock_level_inputs(self, W_ID, D_ID):
+        return StockLevelInputs(W_ID=W_ID, D_ID=D_ID, THRESHOLD=random.randint(10, 20))
+
     def stock_level_transaction(self, W_ID, D_ID):
-        thresh = random.randint(10, 20)
+        return self.dispatch(self.db.execute_stock_level, self.stock_level_body,
+                             self.stock_level_inputs(W_ID, D_ID))
+
+    def stock_level_body(self, inputs):
+        W_ID, D_ID, thresh = inputs.W_ID, inputs.D_ID, inputs.THRESHOLD
         self.db.begin_transaction()
         district_key = DistrictKey(W_ID=W_ID, D_ID=D_ID)
-        district = self.db.get_district(district_key)
+        district = self.db.get_district(district_key, fields=('D_NEXT_O_ID',))
         stocks = set()
-        for i in range(max(0, district['D_NEXT_O_ID'] - 20), district['D_NEXT_O_ID']):
-            order_key = OrderKey(W_ID=W_ID, D_ID=D_ID, O_ID=i)
-            order = self.db.get_order(order_key)
+        order_keys = [OrderKey(W_ID=W_ID, D_ID=D_ID, O_ID=i)
+                      for i in range(max(0, district['D_NEXT_O_ID'] - 20), district['D_NEXT_O_ID'])]
+        self.db.prefetch_orders_with_lines(order_keys)
+        for order_key in order_keys:
+            order, order_lines = self.db.get_order_with_lines(order_key)
             if order is None:
                 continue
-            for j in range(1, order['O_OL_CNT'] + 1):
-                order_line_key = OrderLineKey(W_ID=W_ID, D_ID=D_ID, O_ID=i, OL_NUMBER=j)
-                order_line = self.db.get_order_line(order_line_key)
+            for order_line in order_lines:
                 if order_line is None:
                     continue # the 1% aborted cause this
                 stocks.add(order_line['OL_I_ID'])
+        self.db.prefetch([('STOCK', StockKey(I_ID=s, W_ID=W_ID), ('S_QUANTITY',)) for s in stocks])
         count = 0
         for s in set(stocks):
             stock_key = StockKey(I_ID=s, W_ID=W_ID)
-            stock = self.db.get_stock(stock_key)
+            stock = self.db.get_stock(stock_key, fields=('S_QUANTITY',))
             if stock and stock['S_QUANTITY'] < thresh:
                 count += 1
         self.db.commit_transaction()
 
+    def dispatch(self, procedure, body, inputs):
+        '''run the transaction as a stored procedure if the binding has one,
+        and client-side otherwise; return which path ran'''
+        if procedure is not None:
+            procedure(inputs)
+            return PATH_PROCEDURE
+        body(inputs)
+        return PATH_CLIENT
+
     def generate_ops(self):
+        cards = (('new-order', self.new_order_transaction),
+                 ('payment', self.payment_transaction),
+                 ('order-status', self.order_status_transaction),
+                 ('stock-level', self.stock_level_transaction))
+        mix = self.params.MIX
+        if self.new_order_only:
+            mix = (1, 0, 0, 0)
+        # the smallest deck with the requested proportions
+        gcd = functools.reduce(math.gcd, mix)
         deck = []
-        deck += [('new-order', self.new_order_transaction)] * 10
-        if not self.new_order_only:
-            deck += [('payment', self.payment_transaction)] * 10
-            deck += [('order-status', self.order_status_transaction)]
-            deck += [('stock-level', self.stock_level_transaction)]
+        for card, weight in zip(cards, mix):
+            deck += [card] * (weight // gcd)
         def infinite_deck():
             while True:
                 random.shuffle(deck)
@@ -636,18 +961,34 @@ class TransactionGenerator(object):
 
     def run_transactions(self, W_ID, D_ID, dl):
         for series, card in self.generate_ops():
+            if self.stop is not None and self.stop.is_set():
+                break
             w = W_ID if W_ID is not None else self.generate_W_ID()
             d = D_ID if D_ID is not None else self.generate_D_ID()
             aborts = 0
+            if self.metrics is not None:
+                self.metrics.begin()
             start = time.time()
             while True:
                 try:
-                    card(w, d)
+                    path = card(w, d)
                     end = time.time()
-                    dl.record(series, int(end * 1000), (end - start) * 1000)
+                    latency = (end - start) * 1000
+                    label = series_label(series, path)
+                    dl.record(label, int(end * 1000), latency)
+                    if self.metrics is not None:
+                        self.metrics.record(label, latency, aborts)
+                    if self.summary is not None:
+                        self.summary.record(label, latency, aborts)
+                    self.completed += 1
                     break
                 except DatabaseAbort as e:
                     aborts += 1
+                    if self.tracker is not None:
+                        # bookkeeping, not time spent on the store
+                        charged = time.time()
+                        self.tracker.record_abort()
+                        start += time.time() - charged
             # XXX record aborts
 
 def main_dummy(args, db):
@@ -664,7 +1005,7 @@ def main_wipe(args, db):
 
 def main_load_items(args, db):
     params = Parameters(args.warehouses, args.districts)
-    pg = PopulationGenerator(db, params)
+    pg = PopulationGenerator(db, params, tpcc_kv.checkpoint.create_progress(args, db))
     pg.load_items()
     return 0
 
@@ -678,14 +1019,14 @@ def generate_p(limit, arg):
 
 def main_load_warehouse(args, db):
     params = Parameters(args.warehouses, args.districts)
-    pg = PopulationGenerator(db, params)
+    pg = PopulationGenerator(db, params, tpcc_kv.checkpoint.create_progress(args, db))
     for w in generate_p(params.WAREHOUSE, args.warehouse):
         pg.load_warehouse(w)
     return 0
 
 def main_load_district(args, db):
     params = Parameters(args.warehouses, args.districts)
-    pg = PopulationGenerator(db, params)
+    pg = PopulationGenerator(db, params, tpcc_kv.checkpoint.create_progress(args, db))
     for w in generate_p(params.WAREHOUSE, args.warehouse):
         for d in generate_p(params.DISTRICT, args.district):
             pg.load_district(w, d)
@@ -693,31 +1034,78 @@ def main_load_district(args, db):
 
 def main_load_all(args, db):
     params = Parameters(args.warehouses, args.districts)
-    pg = PopulationGenerator(db, params)
+    pg = PopulationGenerator(db, params, tpcc_kv.checkpoint.create_progress(args, db))
     pg.load_all()
     return 0
 
 def main_run(args, db):
     params = Parameters(args.warehouses, args.districts)
-    tg = TransactionGenerator(db, params, args.operations, new_order_only=args.new_order_only)
+    params.MIX = args.mix
+    params.NURAND_C = args.nurand_c
+    params.REMOTE_ORDER_LINE_PCT = args.remote_order_line_pct
+    params.REMOTE_PAYMENT_PCT = args.remote_payment_pct
+    params.ZIPF_THETA = args.zipf_theta
+    tracker = None
+    if args.contention_top_k > 0:
+        tracker = tpcc_kv.contention.ContentionTracker(db, args.contention_capacity)
+        db = tracker
+    coordinator = None
+    if args.coordinator is not None:
+        coordinator = tpcc_kv.coordinator.Client(args.coordinator)
+    metrics = None
+    if args.metrics_interval > 0:
+        sink = tpcc_kv.metrics.create_sink(args.metrics_format, args.metrics_output)
+        metrics = tpcc_kv.metrics.MetricsReporter(args.metrics_interval, sink)
+    summary = None
+    if args.summary is not None:
+        summary = tpcc_kv.sweep.RunSummary()
+    tg = TransactionGenerator(db, params, args.operations or None,
+            new_order_only=args.new_order_only, tracker=tracker, metrics=metrics,
+            stop=coordinator.stop if coordinator is not None else None,
+            summary=summary)
     dl = ygor.collect.DataLogger(args.output,
-            [ygor.collect.Series(name='new-order', indep_units='ms', indep_precision='precise', dep_units='ms', dep_precision='half'),
-             ygor.collect.Series(name='payment', indep_units='ms', indep_precision='precise', dep_units='ms', dep_precision='half'),
-             ygor.collect.Series(name='order-status', indep_units='ms', indep_precision='precise', dep_units='ms', dep_precision='half'),
-             ygor.collect.Series(name='stock-level', indep_units='ms', indep_precision='precise', dep_units='ms', dep_precision='half')])
+            [ygor.collect.Series(name=series_label(series, path), indep_units='ms', indep_precision='precise', dep_units='ms', dep_precision='half')
+             for series in TRANSACTIONS for path in (PATH_CLIENT, PATH_PROCEDURE)])
+    if coordinator is not None:
+        coordinator.wait_for_start()
+    if metrics is not None:
+        metrics.start()
+    started = time.time()
     try:
         tg.run_transactions(args.warehouse, args.district, dl)
     finally:
+        if summary is not None:
+            summary.write(args.summary, started, time.time())
+        if coordinator is not None:
+            coordinator.done(tg.completed)
+        if metrics is not None:
+            metrics.stop()
         dl.flush_and_destroy()
+        if tracker is not None:
+            tracker.report(sys.stderr, args.contention_top_k)
+
+def binding_module(binding):
+    '''short binding names like "consus" live in tpcc_kv.db_consus'''
+    if '.' not in binding:
+        binding = ('tpcc_kv.db_' + binding).strip('.')
+    return binding
+
+# Actions that do not talk to a binding
+TOOLS = {'coordinate': tpcc_kv.coordinator.main_coordinate,
+         'profile-merge': tpcc_kv.profiling.main_merge,
+         'serve-kv': tpcc_kv.kvserver.main_serve,
+         'spawn': tpcc_kv.zygote.main_spawn,
+         'sweep': tpcc_kv.sweep.main_sweep,
+         'zygote': tpcc_kv.zygote.main_zygote}
 
 def main(argv):
+    if argv and argv[0] in TOOLS:
+        return TOOLS[argv[0]](argv[1:])
     if len(argv) < 2:
         print("usage: <action> <binding>", file=sys.stderr)
         return -1
     action = argv[0]
-    binding = argv[1]
-    if '.' not in binding:
-        binding = ('tpcc_kv.db_' + binding).strip('.')
+    binding = binding_module(argv[1])
     argv = argv[2:]
     random.seed(os.urandom(8))
 
@@ -749,13 +1137,37 @@ def main(argv):
     elif action == 'run':
         load_common = False
         nested_main = main_run
-        parser.add_argument('--operations', type=int, default=1000)
+        parser.add_argument('--operations', type=int, default=1000,
+                help='transactions to run; 0 runs until the coordinator stops the run')
         parser.add_argument('--new-order-only', action='store_true', default=False)
         parser.add_argument('--warehouses', type=int, default=10)
         parser.add_argument('--warehouse', type=int, default=None)
         parser.add_argument('--districts', type=int, default=10)
         parser.add_argument('--district', type=int, default=None)
         parser.add_argument('--output', type=str, default='tpcc-kv.out')
+        parser.add_argument('--mix', type=parse_mix, default=(10, 10, 1, 1),
+                help='new-order,payment,order-status,stock-level weights')
+        parser.add_argument('--nurand-c', type=int, default=C,
+                help='the run-time constant C of NURand')
+        parser.add_argument('--remote-order-line-pct', type=float, default=1.0,
+                help='percent of order lines supplied by a remote warehouse')
+        parser.add_argument('--remote-payment-pct', type=float, default=15.0,
+                help='percent of payments by a customer of a remote warehouse')
+        parser.add_argument('--zipf-theta', type=float, default=0.0,
+                help='choose warehouses/districts from a Zipfian distribution (0 is uniform)')
+        tpcc_kv.coordinator.add_arguments(parser)
+        parser.add_argument('--contention-top-k', type=int, default=0,
+                help='report the K keys most charged with aborts per space')
+        parser.add_argument('--contention-capacity', type=int, default=1024,
+                help='counters kept per space by the contention tracker')
+        parser.add_argument('--metrics-interval', type=float, default=0,
+                help='seconds between live metrics snapshots (0 disables)')
+        parser.add_argument('--metrics-format', choices=('stderr', 'jsonl', 'prometheus'),
+                default='stderr')
+        parser.add_argument('--metrics-output', type=str, default=None,
+                help='file for the jsonl and prometheus formats')
+        parser.add_argument('--summary', type=str, default=None,
+                help='write the run\'s latency histogram and counts to this JSON file when it ends')
     else:
         print("don't know how to %r" % action, file=sys.stderr)
         return -1
@@ -763,6 +1175,11 @@ def main(argv):
     if load_common:
         parser.add_argument('--warehouses', type=int, default=10)
         parser.add_argument('--districts', type=int, default=10)
+        tpcc_kv.checkpoint.add_arguments(parser)
+    # Common for all actions; load and run must agree
+    parser.add_argument('--layout', choices=LAYOUTS, default=LAYOUT_NORMALIZED,
+            help='how order lines are stored')
+    tpcc_kv.profiling.add_arguments(parser)
 
     # Figure out the database to use
     try:
@@ -780,8 +1197,26 @@ def main(argv):
     # Parse the arguments and create the db
     db_mod.add_arguments(parser)
     args = parser.parse_args(argv)
+    if load_common and args.resume and args.checkpoint_dir is None:
+        parser.error('--resume needs --checkpoint-dir')
+    if action == 'run' and args.operations == 0 and args.coordinator is None:
+        parser.error('--operations 0 runs until the coordinator stops it, so it needs --coordinator')
+    if action == 'run' and args.metrics_format != 'stderr' and args.metrics_output is None:
+        parser.error('--metrics-format %s needs --metrics-output' % args.metrics_format)
     db = db_mod.create_database(args)
-    return nested_main(args, db)
+    if args.layout not in db.LAYOUTS:
+        print("binding %r cannot store the %s layout" % (binding, args.layout), file=sys.stderr)
+        return -1
+    db.LAYOUT = args.layout
+    profiler = tpcc_kv.profiling.create_profiler(args)
+    if profiler is not None:
+        profiler.start()
+    try:
+        return nested_main(args, db)
+    finally:
+        if profiler is not None:
+            profiler.stop(tpcc_kv.profiling.output_prefix(args, action))
+        db.close()
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv[1:]) or 0)
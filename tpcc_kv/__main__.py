@@ -0,0 +1,8 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import sys
+
+import tpcc_kv
+
+sys.exit(tpcc_kv.main(sys.argv[1:]) or 0)
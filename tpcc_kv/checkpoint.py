@@ -0,0 +1,128 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import json
+import os
+import sys
+import time
+
+# Progress and checkpoints for the load-* actions.  Loading is split into
+# units that load.sh runs as separate processes: the items, each warehouse
+# and each district.  Every unit records, per table it loads, the last row it
+# has written, in DIR/<unit>.json.  Before a checkpoint is written the loader
+# asks the binding to sync(), so a row in the file is a row in the store.
+# With --resume a restarted unit skips every row its file says is loaded;
+# rows written after the last checkpoint are simply written again.
+#
+# A unit may also keep state that it needs to regenerate the same rows after
+# a restart, such as the seed of a district's customer permutation.
+
+class Table(object):
+    '''one (warehouse, district, table) shard of a unit'''
+
+    def __init__(self, progress, unit, name, total, done):
+        self.progress = progress
+        self.unit = unit
+        self.name = name
+        self.total = total
+        self.done = done
+        self.loaded = 0
+        self.started = time.time()
+
+    def remaining(self):
+        '''the 1-based rows still to load'''
+        return range(self.done + 1, self.total + 1)
+
+    def advance(self, row):
+        self.done = row
+        self.loaded += 1
+        self.progress.tick()
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.loaded / elapsed if elapsed > 0 else 0.
+
+class LoadProgress(object):
+
+    def __init__(self, db, directory=None, resume=False, interval=5.0, report=False, out=sys.stderr):
+        self.db = db
+        self.directory = directory
+        self.resume = resume
+        self.interval = interval
+        self.report = report or directory is not None
+        self.out = out
+        self.units = {}
+        self.tables = []
+        self.next_checkpoint = time.time() + interval
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, unit):
+        return os.path.join(self.directory, unit + '.json')
+
+    def unit(self, unit, warehouse=None, district=None):
+        '''the saved state of unit: {"tables": {...}, ...}'''
+        if unit not in self.units:
+            state = None
+            if self.directory is not None and self.resume and os.path.exists(self.path(unit)):
+                with open(self.path(unit)) as f:
+                    state = json.load(f)
+            if state is None:
+                state = {'warehouse': warehouse, 'district': district, 'tables': {}}
+            self.units[unit] = state
+        return self.units[unit]
+
+    def table(self, unit, name, total, warehouse=None, district=None):
+        state = self.unit(unit, warehouse, district)
+        done = state['tables'].get(name, {}).get('done', 0)
+        if done and self.report:
+            print('load: %s %s resuming after row %d of %d' % (unit, name, done, total), file=self.out)
+        table = Table(self, unit, name, total, done)
+        self.tables.append(table)
+        return table
+
+    def tick(self):
+        if time.time() >= self.next_checkpoint:
+            self.checkpoint()
+
+    def checkpoint(self):
+        self.next_checkpoint = time.time() + self.interval
+        if self.directory is not None:
+            self.db.sync()
+            for table in self.tables:
+                self.units[table.unit]['tables'][table.name] = {'done': table.done, 'total': table.total}
+            for unit in set(table.unit for table in self.tables):
+                self.save(unit)
+        if self.report:
+            for table in self.tables:
+                if not table.loaded and table.done == table.total:
+                    continue
+                print('load: %s %s %d/%d rows, %.0f rows/s' %
+                      (table.unit, table.name, table.done, table.total, table.rate()), file=self.out)
+        self.tables = [t for t in self.tables if t.done < t.total]
+
+    def finish(self, table):
+        '''table is completely loaded; checkpoint so the file says so'''
+        assert table.done == table.total
+        self.checkpoint()
+
+    def save(self, unit):
+        path = self.path(unit)
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.units[unit], f, sort_keys=True)
+        os.replace(tmp, path)
+
+def add_arguments(parser):
+    parser.add_argument('--checkpoint-dir', type=str, default=None, metavar='DIR',
+            help='record how far each table of the load got in DIR')
+    parser.add_argument('--resume', action='store_true', default=False,
+            help='skip the rows that --checkpoint-dir says are already loaded')
+    parser.add_argument('--checkpoint-interval', type=float, default=5.0,
+            help='seconds between checkpoints and progress reports')
+    parser.add_argument('--progress', action='store_true', default=False,
+            help='report rows/s per table even without --checkpoint-dir')
+
+def create_progress(args, db):
+    return LoadProgress(db, args.checkpoint_dir, args.resume,
+                        args.checkpoint_interval, args.progress)
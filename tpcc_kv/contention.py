@@ -0,0 +1,151 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import collections
+import heapq
+
+import tpcc_kv
+
+# Opt-in attribution of DatabaseAbort retries to keys.  The tracker sits
+# between the TransactionGenerator and the binding, remembers which keys each
+# transaction attempt read and wrote, and, when an attempt aborts, charges the
+# abort to every key in its read/write set.  Per-space counts are kept in a
+# space-saving sketch so memory stays bounded no matter how many keys the
+# workload touches.
+
+class SpaceSaving(object):
+    '''Metwally et al.'s space-saving heavy hitters.  Keeps at most capacity
+    counters; a key's true count lies in [count - error, count].'''
+
+    def __init__(self, capacity):
+        assert capacity > 0
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        # a lazy min-heap of (count, key): entries whose count is stale are
+        # skipped when they surface, and the heap is rebuilt before stale
+        # entries outnumber live ones too far
+        self.heap = []
+
+    def add(self, key, count=1):
+        if key in self.counts:
+            self.counts[key] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[key] = count
+            self.errors[key] = 0
+        else:
+            victim = self.pop_min()
+            floor = self.counts.pop(victim)
+            del self.errors[victim]
+            self.counts[key] = floor + count
+            self.errors[key] = floor
+        heapq.heappush(self.heap, (self.counts[key], key))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, k) for k, c in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def pop_min(self):
+        while True:
+            count, key = heapq.heappop(self.heap)
+            if self.counts.get(key) == count:
+                return key
+
+    def top(self, k):
+        keys = sorted(self.counts, key=self.counts.__getitem__, reverse=True)
+        return [(key, self.counts[key], self.errors[key]) for key in keys[:k]]
+
+# Methods on the Database that touch a single key; the space is the rest of
+# the method name, e.g. get_warehouse -> WAREHOUSE.  The order-with-lines
+# methods touch an order and its lines, which are charged to the spaces the
+# layout in use stores them in.
+READ_PREFIXES = ('get_',)
+WRITE_PREFIXES = ('store_', 'increment_')
+
+class ContentionTracker(object):
+
+    def __init__(self, db, capacity=1024):
+        self.db = db
+        self.capacity = capacity
+        self.reads = set()
+        self.writes = set()
+        self.attempts = 0
+        self.aborts = 0
+        self.read_aborts = collections.defaultdict(self.new_sketch)
+        self.write_aborts = collections.defaultdict(self.new_sketch)
+
+    def new_sketch(self):
+        return SpaceSaving(self.capacity)
+
+    def __getattr__(self, name):
+        attr = getattr(self.db, name)
+        if name == 'get_order_with_lines':
+            return self.wrap_get_with_lines(attr)
+        if name == 'store_order_with_lines':
+            return self.wrap_store_with_lines(attr)
+        for prefix in READ_PREFIXES:
+            if name.startswith(prefix):
+                return self.wrap(attr, self.reads, name[len(prefix):].upper())
+        for prefix in WRITE_PREFIXES:
+            if name.startswith(prefix):
+                return self.wrap(attr, self.writes, name[len(prefix):].upper())
+        return attr
+
+    def wrap(self, method, accessed, space):
+        def tracked(key, *args, **kwargs):
+            accessed.add((space, tuple(key)))
+            return method(key, *args, **kwargs)
+        return tracked
+
+    def line_keys(self, key, count):
+        '''the (space, key) of each of the count lines of the order at key'''
+        if self.db.LAYOUT == tpcc_kv.LAYOUT_NORMALIZED:
+            return [('ORDER_LINE', tuple(tpcc_kv.OrderLineKey(W_ID=key.W_ID, D_ID=key.D_ID,
+                                                               O_ID=key.O_ID, OL_NUMBER=ol)))
+                    for ol in range(1, count + 1)]
+        if self.db.LAYOUT == tpcc_kv.LAYOUT_BLOB:
+            return [('ORDER_LINES', tuple(key))]
+        # embedded: the lines are part of the order
+        return []
+
+    def wrap_get_with_lines(self, method):
+        def tracked(key):
+            self.reads.add(('ORDER', tuple(key)))
+            order, order_lines = method(key)
+            # which lines there are is only known once the order is read
+            self.reads.update(self.line_keys(key, len(order_lines)))
+            return order, order_lines
+        return tracked
+
+    def wrap_store_with_lines(self, method):
+        def tracked(key, order, order_lines):
+            self.writes.add(('ORDER', tuple(key)))
+            self.writes.update(self.line_keys(key, len(order_lines)))
+            return method(key, order, order_lines)
+        return tracked
+
+    def begin_transaction(self):
+        self.attempts += 1
+        self.reads.clear()
+        self.writes.clear()
+        return self.db.begin_transaction()
+
+    def record_abort(self):
+        '''charge a DatabaseAbort to the read/write set of the current
+        attempt'''
+        self.aborts += 1
+        for space, key in self.writes:
+            self.write_aborts[space].add(key)
+        for space, key in self.reads - self.writes:
+            self.read_aborts[space].add(key)
+
+    def report(self, out, k):
+        print('contention: %d attempts, %d aborts' % (self.attempts, self.aborts), file=out)
+        spaces = sorted(set(self.write_aborts) | set(self.read_aborts))
+        for space in spaces:
+            print('%s:' % space, file=out)
+            print('  %-8s %-24s %10s %8s' % ('set', 'key', 'aborts', '+/-'), file=out)
+            for which, sketches in (('write', self.write_aborts), ('read', self.read_aborts)):
+                if space not in sketches:
+                    continue
+                for key, count, error in sketches[space].top(k):
+                    print('  %-8s %-24s %10d %8d' % (which, key, count, error), file=out)
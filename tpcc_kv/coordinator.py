@@ -0,0 +1,228 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import argparse
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+# A barrier for the clients of one experiment.  "tpcc-kv coordinate" listens
+# on a Unix or TCP socket and waits for --clients "tpcc-kv run --coordinator"
+# processes to register.  It then hands every client the same start time, a
+# moment in the future, and optionally a stop time; clients sleep until the
+# start so their timeseries line up no matter how long each took to import
+# its binding.  An interrupt to the coordinator stops every client at once.
+#
+# The protocol is one JSON object per line:
+#   client -> {"op": "register", "pid": ...}
+#   coord  -> {"op": "start", "start": <unix time>, "stop": <unix time or null>}
+#   coord  -> {"op": "stop", "stop": <unix time>}
+#   client -> {"op": "done", "pid": ..., "started": ..., "finished": ..., "operations": ...}
+
+CONNECT_TIMEOUT = 60.0
+
+def parse_address(address):
+    '''"unix:/path/to/socket" or "host:port"'''
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    if address.startswith('tcp:'):
+        host = host[len('tcp:'):]
+    return socket.AF_INET, (host or '127.0.0.1', int(port))
+
+def listen(address):
+    family, addr = parse_address(address)
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.unlink(addr)
+    else:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(addr)
+    sock.listen(128)
+    return sock
+
+def connect(address, timeout=CONNECT_TIMEOUT):
+    '''connect, retrying while the other side comes up'''
+    family, addr = parse_address(address)
+    deadline = time.time() + timeout
+    while True:
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        try:
+            sock.connect(addr)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if time.time() >= deadline:
+                raise
+            time.sleep(0.1)
+
+class Channel(object):
+    '''newline-delimited JSON over a stream socket'''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = b''
+
+    def send(self, msg):
+        self.sock.sendall(json.dumps(msg).encode('utf8') + b'\n')
+
+    def recv(self):
+        '''the next message, or None on EOF'''
+        while b'\n' not in self.buf:
+            data = self.sock.recv(4096)
+            if not data:
+                return None
+            self.buf += data
+        line, self.buf = self.buf.split(b'\n', 1)
+        return json.loads(line.decode('utf8'))
+
+    def pending(self):
+        return b'\n' in self.buf
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+class Client(object):
+    '''the "tpcc-kv run" side of the coordinator'''
+
+    def __init__(self, address):
+        self.channel = Channel(connect(address))
+        self.stop = threading.Event()
+        self.deadline = None
+        self.started = None
+
+    def wait_for_start(self):
+        '''register, then block until the common start time'''
+        self.channel.send({'op': 'register', 'pid': os.getpid()})
+        msg = self.channel.recv()
+        assert msg is not None and msg['op'] == 'start', msg
+        self.deadline = msg['stop']
+        threading.Thread(target=self.listen, name='coordinator', daemon=True).start()
+        delay = msg['start'] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        self.started = time.time()
+
+    def listen(self):
+        while not self.stop.is_set():
+            timeout = None
+            if self.deadline is not None:
+                timeout = max(self.deadline - time.time(), 0)
+            readable = self.channel.pending()
+            if not readable:
+                readable, _, _ = select.select([self.channel], [], [], timeout)
+            if not readable:
+                self.stop.set()
+                break
+            msg = self.channel.recv()
+            if msg is None:
+                # the coordinator went away; treat it as a stop
+                self.stop.set()
+                break
+            if msg['op'] == 'stop':
+                self.deadline = msg['stop']
+
+    def done(self, operations):
+        self.stop.set()
+        try:
+            self.channel.send({'op': 'done', 'pid': os.getpid(),
+                               'started': self.started, 'finished': time.time(),
+                               'operations': operations})
+        except OSError:
+            pass
+        self.channel.close()
+
+def add_arguments(parser):
+    parser.add_argument('--coordinator', type=str, default=None, metavar='ADDRESS',
+            help='register with "tpcc-kv coordinate" at unix:PATH or HOST:PORT and start/stop with the other clients')
+
+def main_coordinate(argv):
+    parser = argparse.ArgumentParser(prog='tpcc-kv coordinate')
+    parser.add_argument('--listen', type=str, default='unix:tpcc-kv.sock',
+            help='unix:PATH or HOST:PORT')
+    parser.add_argument('--clients', type=int, required=True,
+            help='clients to wait for before starting')
+    parser.add_argument('--start-delay', type=float, default=1.0,
+            help='seconds between the last registration and the common start')
+    parser.add_argument('--duration', type=float, default=None,
+            help='seconds after the start at which every client stops')
+    args = parser.parse_args(argv)
+    coordinate(args.listen, args.clients, args.start_delay, args.duration)
+    return 0
+
+def coordinate(address, clients, start_delay=1.0, duration=None, out=sys.stderr):
+    '''run one barrier/start/stop round for clients; returns the clients'
+    "done" reports'''
+    server = listen(address)
+    channels = []
+    try:
+        while len(channels) < clients:
+            sock, _ = server.accept()
+            channel = Channel(sock)
+            msg = channel.recv()
+            if msg is None or msg.get('op') != 'register':
+                channel.close()
+                continue
+            channels.append(channel)
+        start = time.time() + start_delay
+        stop = start + duration if duration is not None else None
+        for channel in channels:
+            channel.send({'op': 'start', 'start': start, 'stop': stop})
+        print('coordinator: %d clients start at %.3f' % (clients, start), file=out)
+        reports = wait_for_clients(channels)
+    finally:
+        server.close()
+        for channel in channels:
+            channel.close()
+        family, addr = parse_address(address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
+    if reports:
+        starts = [r['started'] for r in reports]
+        finishes = [r['finished'] for r in reports]
+        print('coordinator: start spread %.1fms, finish spread %.1fms, %d operations' %
+              ((max(starts) - min(starts)) * 1000, (max(finishes) - min(finishes)) * 1000,
+               sum(r['operations'] for r in reports)), file=out)
+    return reports
+
+def wait_for_clients(channels):
+    live = list(channels)
+    reports = []
+    interrupted = []
+    def interrupt(signum, frame):
+        interrupted.append(signum)
+    previous = None
+    if threading.current_thread() is threading.main_thread():
+        previous = signal.signal(signal.SIGINT, interrupt)
+    try:
+        while live:
+            if interrupted:
+                interrupted.clear()
+                for channel in live:
+                    try:
+                        channel.send({'op': 'stop', 'stop': time.time()})
+                    except OSError:
+                        pass
+            try:
+                readable, _, _ = select.select(live, [], [], 0.5)
+            except InterruptedError:
+                continue
+            for channel in readable:
+                msg = channel.recv()
+                if msg is None or msg.get('op') == 'done':
+                    live.remove(channel)
+                    if msg is not None:
+                        reports.append(msg)
+    finally:
+        if previous is not None:
+            signal.signal(signal.SIGINT, previous)
+    return reports
@@ -8,6 +8,7 @@ import tpcc_kv
 class Database(tpcc_kv.Database):
 
     ATOMIC = False
+    LAYOUTS = tpcc_kv.LAYOUTS
 
     def __init__(self, host, port):
         self.host = host
@@ -69,6 +70,12 @@ class Database(tpcc_kv.Database):
     def _store_order_line(self, key, order_line):
         return self.put('ORDER_LINE', self.encode(key), order_line)
 
+    def _get_order_lines(self, key):
+        return self.get('ORDER_LINES', self.encode(key))
+
+    def _store_order_lines(self, key, order_lines):
+        return self.put('ORDER_LINES', self.encode(key), order_lines)
+
     def _get_item(self, key):
         return self.get('ITEM', self.encode(key))
 
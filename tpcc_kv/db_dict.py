@@ -0,0 +1,158 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import os
+import pickle
+
+import tpcc_kv
+
+# An in-process store backed by a dict.  Transactions buffer their writes and
+# apply them on commit; there is only ever one client, so nothing conflicts.
+# The store lives as long as the process unless --dict-file names a pickle to
+# load at start-up and save on close, which lets "load-all" and "run" be
+# separate invocations.  Parallel loaders would overwrite each other's file,
+# so load with load-all.
+
+def duplicate(value):
+    '''copy a record deeply enough that callers cannot alias the store'''
+    if isinstance(value, dict):
+        value = dict(value)
+        if tpcc_kv.ORDER_LINES_FIELD in value:
+            value[tpcc_kv.ORDER_LINES_FIELD] = duplicate(value[tpcc_kv.ORDER_LINES_FIELD])
+        return value
+    if isinstance(value, list):
+        return [duplicate(v) for v in value]
+    return value
+
+class Database(tpcc_kv.Database):
+
+    LAYOUTS = tpcc_kv.LAYOUTS
+    PROJECTION = True
+
+    def __init__(self, path):
+        self.path = path
+        self.data = {}
+        self.dirty = False
+        self.xact = None
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                self.data = pickle.load(f)
+
+    def close(self):
+        self.sync()
+
+    def sync(self):
+        if self.path is not None and self.dirty:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(self.data, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.path)
+            self.dirty = False
+
+    def setup(self):
+        pass
+
+    def wipe(self):
+        self.data = {}
+        self.dirty = True
+
+    def begin_transaction(self):
+        assert self.xact is None
+        self.xact = {}
+
+    def commit_transaction(self):
+        self.data.update(self.xact)
+        self.dirty = self.dirty or bool(self.xact)
+        self.xact = None
+
+    def abort_transaction(self):
+        self.xact = None
+
+    def _get_warehouse(self, key):
+        return self.get('WAREHOUSE', key)
+
+    def _store_warehouse(self, key, warehouse):
+        return self.put('WAREHOUSE', key, warehouse)
+
+    def _get_district(self, key):
+        return self.get('DISTRICT', key)
+
+    def _store_district(self, key, district):
+        return self.put('DISTRICT', key, district)
+
+    def _get_customer(self, key):
+        return self.get('CUSTOMER', key)
+
+    def _store_customer(self, key, customer):
+        return self.put('CUSTOMER', key, customer)
+
+    def _store_new_order(self, key, new_order):
+        return self.put('NEW_ORDER', key, new_order)
+
+    def _get_order(self, key):
+        return self.get('ORDER', key)
+
+    def _store_order(self, key, order):
+        return self.put('ORDER', key, order)
+
+    def _get_order_line(self, key):
+        return self.get('ORDER_LINE', key)
+
+    def _store_order_line(self, key, order_line):
+        return self.put('ORDER_LINE', key, order_line)
+
+    def _get_order_lines(self, key):
+        return self.get('ORDER_LINES', key)
+
+    def _store_order_lines(self, key, order_lines):
+        return self.put('ORDER_LINES', key, order_lines)
+
+    def _get_item(self, key):
+        return self.get('ITEM', key)
+
+    def _store_item(self, key, item):
+        return self.put('ITEM', key, item)
+
+    def _get_stock(self, key):
+        return self.get('STOCK', key)
+
+    def _store_stock(self, key, stock):
+        return self.put('STOCK', key, stock)
+
+    def _store_history(self, key, history):
+        return self.put('HISTORY', key, history)
+
+    def _get_fields(self, space, key, fields):
+        record = self.lookup(space, key)
+        if record is None:
+            return None
+        return {f: duplicate(record[f]) for f in fields}
+
+    def _update_fields(self, space, key, values):
+        record = duplicate(self.lookup(space, key))
+        record.update(values)
+        return self.put(space, key, record)
+
+    def lookup(self, space, key):
+        k = (space, tuple(key))
+        if self.xact is not None and k in self.xact:
+            return self.xact[k]
+        return self.data.get(k)
+
+    def get(self, space, key):
+        return duplicate(self.lookup(space, key))
+
+    def put(self, space, key, value):
+        k = (space, tuple(key))
+        if self.xact is None:
+            self.data[k] = duplicate(value)
+            self.dirty = True
+        else:
+            self.xact[k] = duplicate(value)
+
+def add_arguments(parser):
+    parser.add_argument('--dict-file', type=str, default=None,
+            help='pickle to load the store from and save it to')
+
+def create_database(args):
+    return Database(args.dict_file)
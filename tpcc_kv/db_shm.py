@@ -0,0 +1,401 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import errno
+import fcntl
+import marshal
+import mmap
+import os
+import struct
+import time
+
+import tpcc_kv
+
+# A store that many "tpcc-kv run" processes on one machine can share, for
+# measuring how the harness scales across cores without an external server.
+#
+# Every table is an array of fixed-size slots in one mmap'd file (by default
+# in /dev/shm).  TPC-C's keys are dense integers, so a key maps straight to a
+# slot: STOCK (I_ID, W_ID) is slot (W_ID - 1) * STOCK + I_ID - 1 and so on.
+# ORDER, NEW_ORDER and their lines are rings of --shm-order-capacity orders
+# per district; an order that has been overwritten by a newer one reads as
+# missing.  The file's header records the geometry chosen at setup, so only
+# "setup" needs the --shm-* sizing arguments.
+#
+# A slot is a 64-bit version, a 32-bit length and a marshalled (key, values)
+# tuple.  Reads are lock-free: a seqlock retries while the version is odd or
+# changes underneath.  Transactions buffer their writes; commit takes
+# non-blocking fcntl locks on the slots it writes (exclusive) and read
+# (shared), checks that nothing it read has changed version, writes, and
+# unlocks.  Any lock it cannot take immediately, or any changed version, is a
+# DatabaseAbort.
+
+MAGIC = b'TPCCSHM1'
+HEADER = struct.Struct('<8sIIII')  # magic, warehouses, districts, order capacity, layout
+HEADER_SIZE = 4096
+SLOT = struct.Struct('<QI')         # version, length
+SEQLOCK_SPINS = 1000
+
+LAYOUT_CODES = {tpcc_kv.LAYOUT_NORMALIZED: 0, tpcc_kv.LAYOUT_EMBEDDED: 1, tpcc_kv.LAYOUT_BLOB: 2}
+MAX_ORDER_LINES = 15
+
+# bytes per slot, header included
+SLOT_SIZES = {'ITEM': 128,
+              'WAREHOUSE': 160,
+              'STOCK': 384,
+              'DISTRICT': 192,
+              'CUSTOMER': 800,
+              'HISTORY': 128,
+              'ORDER': 96,
+              'NEW_ORDER': 64,
+              'ORDER_LINE': 128,
+              'ORDER_LINES': 1664}
+EMBEDDED_ORDER_SLOT = 1728
+
+FIELDS = {'ITEM': sorted(tpcc_kv.ITEM_FIELDS),
+          'WAREHOUSE': sorted(tpcc_kv.WAREHOUSE_FIELDS),
+          'STOCK': sorted(tpcc_kv.STOCK_FIELDS),
+          'DISTRICT': sorted(tpcc_kv.DISTRICT_FIELDS),
+          'CUSTOMER': sorted(tpcc_kv.CUSTOMER_FIELDS),
+          'HISTORY': sorted(tpcc_kv.HISTORY_FIELDS),
+          'ORDER': sorted(tpcc_kv.ORDER_FIELDS),
+          'NEW_ORDER': sorted(tpcc_kv.NEW_ORDER_FIELDS),
+          'ORDER_LINE': sorted(tpcc_kv.ORDER_LINE_FIELDS)}
+
+def pack_record(space, fields, record, extra=()):
+    '''the record's values in field order; a record whose fields are not
+    exactly the schema (plus extra) would lose data, so it is an error'''
+    if len(record) != len(fields) + len(extra) or not all(f in record for f in fields + list(extra)):
+        raise ValueError('%s record has fields %s; this store expects %s' %
+                         (space, sorted(record), sorted(fields + list(extra))))
+    return tuple(record[f] for f in fields)
+
+def unpack_record(fields, values):
+    return dict(zip(fields, values))
+
+class Geometry(object):
+    '''where each table's slots live in the file'''
+
+    def __init__(self, warehouses, districts, order_capacity, layout):
+        self.params = tpcc_kv.Parameters(warehouses, districts)
+        self.order_capacity = order_capacity
+        self.layout = layout
+        W = warehouses
+        D = districts
+        orders = W * D * order_capacity
+        counts = {'ITEM': self.params.ITEMS,
+                  'WAREHOUSE': W,
+                  'STOCK': W * self.params.STOCK,
+                  'DISTRICT': W * D,
+                  'CUSTOMER': W * D * self.params.CUSTOMER_PER_DISTRICT,
+                  'HISTORY': W * D * self.params.CUSTOMER_PER_DISTRICT,
+                  'ORDER': orders,
+                  'NEW_ORDER': orders,
+                  'ORDER_LINE': orders * MAX_ORDER_LINES if layout == tpcc_kv.LAYOUT_NORMALIZED else 0,
+                  'ORDER_LINES': orders if layout == tpcc_kv.LAYOUT_BLOB else 0}
+        self.slot_size = dict(SLOT_SIZES)
+        if layout == tpcc_kv.LAYOUT_EMBEDDED:
+            self.slot_size['ORDER'] = EMBEDDED_ORDER_SLOT
+        self.base = {}
+        self.count = counts
+        offset = HEADER_SIZE
+        for space in sorted(counts):
+            self.base[space] = offset
+            offset += counts[space] * self.slot_size[space]
+        self.size = offset
+
+    def district_index(self, W_ID, D_ID):
+        return (W_ID - 1) * self.params.DISTRICT + D_ID - 1
+
+    def order_index(self, key):
+        return self.district_index(key.W_ID, key.D_ID) * self.order_capacity + (key.O_ID - 1) % self.order_capacity
+
+    def index(self, space, key):
+        if space == 'ITEM':
+            idx = key.I_ID - 1
+        elif space == 'WAREHOUSE':
+            idx = key.W_ID - 1
+        elif space == 'STOCK':
+            idx = (key.W_ID - 1) * self.params.STOCK + key.I_ID - 1
+        elif space == 'DISTRICT':
+            idx = self.district_index(key.W_ID, key.D_ID)
+        elif space in ('CUSTOMER', 'HISTORY'):
+            idx = self.district_index(key.W_ID, key.D_ID) * self.params.CUSTOMER_PER_DISTRICT + key.C_ID - 1
+        elif space in ('ORDER', 'NEW_ORDER', 'ORDER_LINES'):
+            idx = self.order_index(key)
+        elif space == 'ORDER_LINE':
+            assert 1 <= key.OL_NUMBER <= MAX_ORDER_LINES
+            idx = self.order_index(key) * MAX_ORDER_LINES + key.OL_NUMBER - 1
+        else:
+            raise KeyError(space)
+        if not 0 <= idx < self.count[space]:
+            raise IndexError('%s key %r is outside the geometry chosen at setup' % (space, tuple(key)))
+        return idx
+
+    def offset(self, space, idx):
+        return self.base[space] + idx * self.slot_size[space]
+
+class Database(tpcc_kv.Database):
+
+    LAYOUTS = tpcc_kv.LAYOUTS
+
+    def __init__(self, path, warehouses, districts, order_capacity):
+        self.path = path
+        self.warehouses = warehouses
+        self.districts = districts
+        self.order_capacity = order_capacity
+        self.fd = None
+        self.mm = None
+        self.geometry = None
+        self.reads = None
+        self.writes = None
+        if os.path.exists(path):
+            self.open()
+
+    def open(self):
+        self.fd = os.open(self.path, os.O_RDWR)
+        magic, W, D, capacity, layout = HEADER.unpack(os.pread(self.fd, HEADER.size, 0))
+        if magic != MAGIC:
+            raise RuntimeError('%s is not a tpcc-kv shared memory store' % self.path)
+        layout = {v: k for k, v in LAYOUT_CODES.items()}[layout]
+        self.geometry = Geometry(W, D, capacity, layout)
+        self.mm = mmap.mmap(self.fd, self.geometry.size)
+
+    def close(self):
+        # closing the fd also drops any fcntl locks this process holds
+        if self.mm is not None:
+            self.mm.close()
+            os.close(self.fd)
+            self.mm = None
+            self.fd = None
+
+    def setup(self):
+        self.close()
+        geometry = Geometry(self.warehouses, self.districts, self.order_capacity, self.LAYOUT)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, geometry.size)
+            os.pwrite(fd, HEADER.pack(MAGIC, self.warehouses, self.districts,
+                                      self.order_capacity, LAYOUT_CODES[self.LAYOUT]), 0)
+        finally:
+            os.close(fd)
+        self.open()
+
+    def wipe(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def check_open(self):
+        if self.mm is None:
+            raise RuntimeError('%s does not exist; run "tpcc-kv setup shm" first' % self.path)
+        if self.geometry.layout != self.LAYOUT:
+            raise RuntimeError('%s was set up for the %s layout' % (self.path, self.geometry.layout))
+
+    def begin_transaction(self):
+        assert self.writes is None
+        self.check_open()
+        self.reads = {}
+        self.writes = {}
+
+    def commit_transaction(self):
+        reads, writes = self.reads, self.writes
+        self.reads = self.writes = None
+        # read-only transactions lock too: a writer holds its locks until
+        # every slot it writes has its new version, so unchanged versions
+        # under the shared locks mean the reads were consistent with one
+        # another
+        locked = []
+        try:
+            for slot in sorted(writes):
+                self.lock(slot, fcntl.LOCK_EX)
+                locked.append(slot)
+            for slot in sorted(reads):
+                if slot not in writes:
+                    self.lock(slot, fcntl.LOCK_SH)
+                    locked.append(slot)
+            for (space, idx), version in reads.items():
+                if self.version(space, idx) != version:
+                    raise tpcc_kv.DatabaseAbort()
+            for (space, idx), payload in writes.items():
+                self.write_slot(space, idx, payload)
+        finally:
+            for slot in locked:
+                self.unlock(slot)
+
+    def abort_transaction(self):
+        self.reads = self.writes = None
+
+    def lock(self, slot, how):
+        space, idx = slot
+        try:
+            fcntl.lockf(self.fd, how | fcntl.LOCK_NB, SLOT.size, self.geometry.offset(space, idx))
+        except OSError as e:
+            if e.errno in (errno.EACCES, errno.EAGAIN):
+                raise tpcc_kv.DatabaseAbort()
+            raise
+
+    def unlock(self, slot):
+        space, idx = slot
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, SLOT.size, self.geometry.offset(space, idx))
+
+    def header(self, offset):
+        return SLOT.unpack(self.mm[offset:offset + SLOT.size])
+
+    def set_header(self, offset, version, length):
+        # one copy of the packed bytes: pack_into zeroes the header before
+        # filling it in, and a reader could see the zeroed length
+        self.mm[offset:offset + SLOT.size] = SLOT.pack(version, length)
+
+    def version(self, space, idx):
+        return self.header(self.geometry.offset(space, idx))[0]
+
+    def read_slot(self, space, idx):
+        '''seqlock read; returns (version, payload bytes or None)'''
+        offset = self.geometry.offset(space, idx)
+        for spin in range(SEQLOCK_SPINS):
+            version, length = self.header(offset)
+            if version & 1:
+                time.sleep(0)
+                continue
+            payload = self.mm[offset + SLOT.size:offset + SLOT.size + length] if length else None
+            if self.header(offset)[0] == version:
+                return version, payload
+        # the harness retries with a new begin_transaction
+        self.abort_transaction()
+        raise tpcc_kv.DatabaseAbort()
+
+    def write_slot(self, space, idx, payload):
+        '''caller holds the slot's lock'''
+        offset = self.geometry.offset(space, idx)
+        if SLOT.size + len(payload) > self.geometry.slot_size[space]:
+            raise ValueError('%s record of %d bytes does not fit its %d byte slot' %
+                             (space, len(payload), self.geometry.slot_size[space] - SLOT.size))
+        version = self.header(offset)[0]
+        self.set_header(offset, version + 1, len(payload))
+        self.mm[offset + SLOT.size:offset + SLOT.size + len(payload)] = payload
+        self.set_header(offset, version + 2, len(payload))
+
+    def encode(self, space, key, record):
+        if space == 'ORDER_LINES':
+            values = [pack_record('ORDER_LINE', FIELDS['ORDER_LINE'], r) for r in record]
+        elif space == 'ORDER' and self.LAYOUT == tpcc_kv.LAYOUT_EMBEDDED:
+            values = pack_record(space, FIELDS[space], record, (tpcc_kv.ORDER_LINES_FIELD,))
+            lines = [pack_record('ORDER_LINE', FIELDS['ORDER_LINE'], r) for r in record[tpcc_kv.ORDER_LINES_FIELD]]
+            values = (values, lines)
+        else:
+            values = pack_record(space, FIELDS[space], record)
+        return marshal.dumps((tuple(key), values))
+
+    def decode(self, space, key, payload):
+        if payload is None:
+            return None
+        stored_key, values = marshal.loads(payload)
+        if stored_key != tuple(key):
+            # a ring slot that now holds a newer order
+            return None
+        if space == 'ORDER_LINES':
+            return [unpack_record(FIELDS['ORDER_LINE'], v) for v in values]
+        if space == 'ORDER' and self.LAYOUT == tpcc_kv.LAYOUT_EMBEDDED:
+            values, lines = values
+            record = unpack_record(FIELDS[space], values)
+            record[tpcc_kv.ORDER_LINES_FIELD] = [unpack_record(FIELDS['ORDER_LINE'], v) for v in lines]
+            return record
+        return unpack_record(FIELDS[space], values)
+
+    def get(self, space, key):
+        self.check_open()
+        slot = (space, self.geometry.index(space, key))
+        if self.writes is not None and slot in self.writes:
+            return self.decode(space, key, self.writes[slot])
+        version, payload = self.read_slot(*slot)
+        if self.reads is not None:
+            if self.reads.setdefault(slot, version) != version:
+                self.abort_transaction()
+                raise tpcc_kv.DatabaseAbort()
+        return self.decode(space, key, payload)
+
+    def put(self, space, key, value):
+        self.check_open()
+        slot = (space, self.geometry.index(space, key))
+        payload = self.encode(space, key, value)
+        if self.writes is not None:
+            self.writes[slot] = payload
+            return
+        # outside a transaction, e.g. while loading: wait for the lock
+        space, idx = slot
+        offset = self.geometry.offset(space, idx)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, SLOT.size, offset)
+        try:
+            self.write_slot(space, idx, payload)
+        finally:
+            self.unlock(slot)
+
+    def _get_warehouse(self, key):
+        return self.get('WAREHOUSE', key)
+
+    def _store_warehouse(self, key, warehouse):
+        return self.put('WAREHOUSE', key, warehouse)
+
+    def _get_district(self, key):
+        return self.get('DISTRICT', key)
+
+    def _store_district(self, key, district):
+        return self.put('DISTRICT', key, district)
+
+    def _get_customer(self, key):
+        return self.get('CUSTOMER', key)
+
+    def _store_customer(self, key, customer):
+        return self.put('CUSTOMER', key, customer)
+
+    def _store_new_order(self, key, new_order):
+        return self.put('NEW_ORDER', key, new_order)
+
+    def _get_order(self, key):
+        return self.get('ORDER', key)
+
+    def _store_order(self, key, order):
+        return self.put('ORDER', key, order)
+
+    def _get_order_line(self, key):
+        return self.get('ORDER_LINE', key)
+
+    def _store_order_line(self, key, order_line):
+        return self.put('ORDER_LINE', key, order_line)
+
+    def _get_order_lines(self, key):
+        return self.get('ORDER_LINES', key)
+
+    def _store_order_lines(self, key, order_lines):
+        return self.put('ORDER_LINES', key, order_lines)
+
+    def _get_item(self, key):
+        return self.get('ITEM', key)
+
+    def _store_item(self, key, item):
+        return self.put('ITEM', key, item)
+
+    def _get_stock(self, key):
+        return self.get('STOCK', key)
+
+    def _store_stock(self, key, stock):
+        return self.put('STOCK', key, stock)
+
+    def _store_history(self, key, history):
+        return self.put('HISTORY', key, history)
+
+def add_arguments(parser):
+    parser.add_argument('--shm-path', type=str, default='/dev/shm/tpcc-kv',
+            help='file backing the store')
+    parser.add_argument('--shm-warehouses', type=int, default=None,
+            help='warehouses to size the store for at setup (default: --warehouses, else 10)')
+    parser.add_argument('--shm-districts', type=int, default=None,
+            help='districts per warehouse to size the store for at setup (default: --districts, else 10)')
+    parser.add_argument('--shm-order-capacity', type=int, default=6000,
+            help='orders kept per district before the oldest are overwritten')
+
+def create_database(args):
+    warehouses = args.shm_warehouses or getattr(args, 'warehouses', None) or 10
+    districts = args.shm_districts or getattr(args, 'districts', None) or 10
+    return Database(args.shm_path, warehouses, districts, args.shm_order_capacity)
@@ -0,0 +1,254 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import argparse
+import importlib
+import math
+import random
+import shlex
+import time
+
+import tpcc_kv
+
+# A wrapper binding that makes any other binding behave as if it were across
+# a network.  Every operation pays a round trip drawn from a configurable
+# distribution plus a per-byte bandwidth cost, commits pay an extra commit
+# latency, and commits fail with DatabaseAbort at a configurable rate.  With
+# the in-process dict binding underneath, this is a reproducible stand-in for
+# a real deployment on a laptop or CI box, e.g.:
+#
+#   tpcc-kv load-all sim --sim-binding dict --sim-args '--dict-file tpcc.pickle'
+#   tpcc-kv run sim --sim-binding dict --sim-args '--dict-file tpcc.pickle' \
+#       --sim-rtt-ms 0.5 --sim-rtt-dist lognormal --sim-rtt-jitter-ms 0.2 \
+#       --sim-commit-ms 2 --sim-abort-rate 0.01 --sim-seed 42
+
+class Network(object):
+    '''draws delays; all randomness comes from a private, seedable RNG so the
+    workload's own random stream is left alone'''
+
+    def __init__(self, args):
+        self.rng = random.Random(args.sim_seed)
+        self.rtt = args.sim_rtt_ms / 1000.
+        self.jitter = args.sim_rtt_jitter_ms / 1000.
+        self.dist = args.sim_rtt_dist
+        self.commit = args.sim_commit_ms / 1000.
+        self.per_byte = 0.
+        if args.sim_bandwidth_mbps > 0:
+            self.per_byte = 8. / (args.sim_bandwidth_mbps * 1e6)
+        self.abort_rate = args.sim_abort_rate
+
+    def round_trip(self):
+        if self.dist == 'constant' or self.jitter == 0:
+            return self.rtt
+        if self.dist == 'uniform':
+            return max(0., self.rtt + self.rng.uniform(-self.jitter, self.jitter))
+        if self.dist == 'normal':
+            return max(0., self.rng.gauss(self.rtt, self.jitter))
+        if self.dist == 'exponential':
+            return self.rtt + self.rng.expovariate(1. / self.jitter)
+        if self.dist == 'lognormal':
+            # median rtt; jitter sets the spread in log space
+            if self.rtt == 0:
+                return 0.
+            return self.rng.lognormvariate(math.log(self.rtt), self.jitter / self.rtt)
+        raise ValueError('unknown rtt distribution %r' % self.dist)
+
+    def size(self, value):
+        # a repr per operation is not free; skip it when bandwidth is unused
+        if self.per_byte == 0 or value is None:
+            return 0
+        return len(repr(value))
+
+    def wait(self, nbytes=0, extra=0.):
+        delay = self.round_trip() + nbytes * self.per_byte + extra
+        if delay > 0:
+            time.sleep(delay)
+
+    def abort(self):
+        return self.abort_rate > 0 and self.rng.random() < self.abort_rate
+
+class Database(tpcc_kv.Database):
+
+    def __init__(self, inner, network, buffered_writes):
+        self.inner = inner
+        self.network = network
+        self.buffered_writes = buffered_writes
+        self.in_xact = False
+        self.buffered = 0
+        self.LAYOUTS = inner.LAYOUTS
+        self.ATOMIC = inner.ATOMIC
+        self.PROJECTION = inner.PROJECTION
+        for hook in ('execute_new_order', 'execute_payment',
+                     'execute_order_status', 'execute_stock_level'):
+            procedure = getattr(inner, hook)
+            if procedure is not None:
+                setattr(self, hook, self.remote_procedure(procedure))
+
+    # main() sets the layout on the wrapper; the inner binding must store
+    # the same one
+    @property
+    def LAYOUT(self):
+        return self.inner.LAYOUT
+
+    @LAYOUT.setter
+    def LAYOUT(self, layout):
+        self.inner.LAYOUT = layout
+
+    def close(self):
+        self.inner.close()
+
+    def sync(self):
+        return self.inner.sync()
+
+    def setup(self):
+        return self.inner.setup()
+
+    def wipe(self):
+        return self.inner.wipe()
+
+    def begin_transaction(self):
+        self.in_xact = True
+        self.buffered = 0
+        return self.inner.begin_transaction()
+
+    def commit_transaction(self):
+        self.in_xact = False
+        self.network.wait(self.buffered, self.network.commit)
+        if self.network.abort():
+            self.inner.abort_transaction()
+            raise tpcc_kv.DatabaseAbort()
+        return self.inner.commit_transaction()
+
+    def abort_transaction(self):
+        self.in_xact = False
+        self.network.wait()
+        return self.inner.abort_transaction()
+
+    def remote_procedure(self, procedure):
+        def call(inputs):
+            self.network.wait(self.network.size(inputs), self.network.commit)
+            if self.network.abort():
+                raise tpcc_kv.DatabaseAbort()
+            return procedure(inputs)
+        return call
+
+    def received(self, value):
+        '''charge a round trip that brings back value'''
+        self.network.wait(self.network.size(value))
+        return value
+
+    def sent(self, value):
+        '''charge a write of value, or hold it for the commit'''
+        if self.in_xact and self.buffered_writes:
+            self.buffered += self.network.size(value)
+        else:
+            self.network.wait(self.network.size(value))
+
+    def _get_warehouse(self, key):
+        return self.received(self.inner._get_warehouse(key))
+
+    def _store_warehouse(self, key, warehouse):
+        self.sent(warehouse)
+        return self.inner._store_warehouse(key, warehouse)
+
+    def _get_district(self, key):
+        return self.received(self.inner._get_district(key))
+
+    def _store_district(self, key, district):
+        self.sent(district)
+        return self.inner._store_district(key, district)
+
+    def _get_customer(self, key):
+        return self.received(self.inner._get_customer(key))
+
+    def _store_customer(self, key, customer):
+        self.sent(customer)
+        return self.inner._store_customer(key, customer)
+
+    def _store_new_order(self, key, new_order):
+        self.sent(new_order)
+        return self.inner._store_new_order(key, new_order)
+
+    def _get_order(self, key):
+        return self.received(self.inner._get_order(key))
+
+    def _store_order(self, key, order):
+        self.sent(order)
+        return self.inner._store_order(key, order)
+
+    def _get_order_line(self, key):
+        return self.received(self.inner._get_order_line(key))
+
+    def _store_order_line(self, key, order_line):
+        self.sent(order_line)
+        return self.inner._store_order_line(key, order_line)
+
+    def _get_order_lines(self, key):
+        return self.received(self.inner._get_order_lines(key))
+
+    def _store_order_lines(self, key, order_lines):
+        self.sent(order_lines)
+        return self.inner._store_order_lines(key, order_lines)
+
+    def _get_item(self, key):
+        return self.received(self.inner._get_item(key))
+
+    def _store_item(self, key, item):
+        self.sent(item)
+        return self.inner._store_item(key, item)
+
+    def _get_stock(self, key):
+        return self.received(self.inner._get_stock(key))
+
+    def _store_stock(self, key, stock):
+        self.sent(stock)
+        return self.inner._store_stock(key, stock)
+
+    def _store_history(self, key, history):
+        self.sent(history)
+        return self.inner._store_history(key, history)
+
+    def _get_fields(self, space, key, fields):
+        return self.received(self.inner._get_fields(space, key, fields))
+
+    def _update_fields(self, space, key, values):
+        self.sent(values)
+        return self.inner._update_fields(space, key, values)
+
+    def _increment(self, space, key, deltas):
+        # the pre-increment values come back, so this is never buffered
+        return self.received(self.inner._increment(space, key, deltas))
+
+def add_arguments(parser):
+    parser.add_argument('--sim-binding', type=str, default='dict',
+            help='binding to wrap')
+    parser.add_argument('--sim-args', type=str, default='',
+            help='arguments for the wrapped binding, as one shell-quoted string')
+    parser.add_argument('--sim-rtt-ms', type=float, default=0.5,
+            help='round trip per operation (mean; median for lognormal)')
+    parser.add_argument('--sim-rtt-dist', default='constant',
+            choices=('constant', 'uniform', 'normal', 'exponential', 'lognormal'))
+    parser.add_argument('--sim-rtt-jitter-ms', type=float, default=0.,
+            help='spread: half-width (uniform), stddev (normal), tail mean (exponential) or log-space sigma times rtt (lognormal)')
+    parser.add_argument('--sim-commit-ms', type=float, default=0.,
+            help='extra latency of a commit')
+    parser.add_argument('--sim-bandwidth-mbps', type=float, default=0.,
+            help='charge each value its size at this bandwidth (0 disables)')
+    parser.add_argument('--sim-abort-rate', type=float, default=0.,
+            help='probability that a commit fails with DatabaseAbort')
+    parser.add_argument('--sim-buffered-writes', action='store_true', default=False,
+            help='writes inside a transaction are sent with the commit instead of one round trip each')
+    parser.add_argument('--sim-seed', type=int, default=None,
+            help='seed for the delays and injected aborts')
+
+def create_database(args):
+    binding = tpcc_kv.binding_module(args.sim_binding)
+    inner_mod = importlib.import_module(binding)
+    parser = argparse.ArgumentParser(prog='--sim-args')
+    inner_mod.add_arguments(parser)
+    # start from the outer arguments so the wrapped binding sees e.g.
+    # --warehouses, and fill in its own defaults around them
+    inner_args = parser.parse_args(shlex.split(args.sim_args),
+                                   namespace=argparse.Namespace(**vars(args)))
+    inner = inner_mod.create_database(inner_args)
+    return Database(inner, Network(args), args.sim_buffered_writes)
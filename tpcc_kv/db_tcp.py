@@ -0,0 +1,273 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import copy
+import json
+import socket
+
+import tpcc_kv
+import tpcc_kv.coordinator
+import tpcc_kv.kvserver
+
+# The binding for "tpcc-kv serve-kv", e.g.:
+#
+#   tpcc-kv serve-kv --listen 127.0.0.1:7379 &
+#   tpcc-kv load-all tcp --tcp-address 127.0.0.1:7379
+#   tpcc-kv run tcp --tcp-address 127.0.0.1:7379
+#
+# Inside a transaction every read is one round trip, except that the reads
+# the harness prefetches (new-order's items and stock, stock-level's orders
+# and stock) go out together in one frame, and all of the writes go to the
+# server with the commit in a single frame.  Writes outside a
+# transaction (loading) are not waited for: they are batched --tcp-batch to a
+# frame, and up to --tcp-window frames are kept in flight on each of
+# --tcp-connections connections before the client reads any replies.  Any
+# read or transaction first drains the writes still in flight, so a client
+# always sees its own loads.
+
+class Connection(object):
+
+    def __init__(self, address):
+        self.sock = tpcc_kv.coordinator.connect(address)
+        if self.sock.family != socket.AF_UNIX:
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile('rb')
+        self.in_flight = 0
+
+    def send(self, ops):
+        self.sock.sendall(tpcc_kv.kvserver.encode(ops))
+        self.in_flight += 1
+
+    def recv(self):
+        header = self.rfile.read(tpcc_kv.kvserver.FRAME.size)
+        if len(header) < tpcc_kv.kvserver.FRAME.size:
+            raise ConnectionError('serve-kv closed the connection')
+        (length,) = tpcc_kv.kvserver.FRAME.unpack(header)
+        self.in_flight -= 1
+        results = json.loads(self.rfile.read(length).decode('utf8'))
+        for result in results:
+            if isinstance(result, dict) and 'error' in result:
+                raise RuntimeError('serve-kv: %s' % result['error'])
+        return results
+
+    def call(self, ops):
+        assert self.in_flight == 0
+        self.send(ops)
+        return self.recv()
+
+    def drain(self):
+        while self.in_flight:
+            self.recv()
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+class Database(tpcc_kv.Database):
+
+    LAYOUTS = tpcc_kv.LAYOUTS
+    PROJECTION = True
+    PREFETCH = True
+
+    def __init__(self, address, connections, batch, window):
+        self.pool = [Connection(address) for c in range(connections)]
+        self.batch = batch
+        self.window = window
+        self.next = 0
+        self.pending = []
+        self.reads = None
+        self.writes = None
+        self.prefetched = None
+
+    def close(self):
+        self.drain()
+        for conn in self.pool:
+            conn.close()
+        self.pool = []
+
+    def sync(self):
+        self.drain()
+
+    def setup(self):
+        pass
+
+    def wipe(self):
+        self.drain()
+        self.pool[0].call([['wipe']])
+
+    def begin_transaction(self):
+        assert self.writes is None
+        self.drain()
+        self.reads = {}
+        self.writes = {}
+        self.prefetched = {}
+
+    def commit_transaction(self):
+        reads = [[space, list(key), version] for (space, key), version in self.reads.items()]
+        writes = [[space, list(key), record, partial] for (space, key), (record, partial) in self.writes.items()]
+        self.reads = self.writes = self.prefetched = None
+        (ok,) = self.pool[0].call([['commit', reads, writes]])
+        if not ok:
+            raise tpcc_kv.DatabaseAbort()
+
+    def abort_transaction(self):
+        self.reads = self.writes = self.prefetched = None
+
+    def flush(self):
+        '''send the pending writes as one frame on the next connection'''
+        if not self.pending:
+            return
+        conn = self.pool[self.next]
+        self.next = (self.next + 1) % len(self.pool)
+        if conn.in_flight >= self.window:
+            conn.recv()
+        conn.send(self.pending)
+        self.pending = []
+
+    def drain(self):
+        self.flush()
+        for conn in self.pool:
+            conn.drain()
+
+    def get(self, space, key, fields=None):
+        k = (space, tuple(key))
+        if self.writes is not None and k in self.writes:
+            record, partial = self.writes[k]
+            if not partial:
+                return self.project(record, fields)
+            # fetch the rest of the record and overlay the buffered fields
+            base = self.fetch(space, k, None) or {}
+            base.update(record)
+            return self.project(base, fields)
+        return self.fetch(space, k, fields)
+
+    def _prefetch(self, reads):
+        '''get reads in one frame; fetch serves them from there'''
+        if self.prefetched is None:
+            return
+        wanted = {}
+        for space, key, fields in reads:
+            k = (space, tuple(key))
+            if k not in self.writes and k not in self.prefetched:
+                wanted.setdefault(k, None if fields is None else list(fields))
+        if not wanted:
+            return
+        self.drain()
+        results = self.pool[0].call([['get', space, list(key), fields]
+                                     for (space, key), fields in wanted.items()])
+        for (k, fields), (version, record) in zip(wanted.items(), results):
+            self.prefetched[k] = (version, record, fields)
+
+    def fetch(self, space, k, fields):
+        # kept for the whole transaction: every get of k sees the version
+        # recorded in the read set anyway
+        prefetched = self.prefetched.get(k) if self.prefetched is not None else None
+        if prefetched is not None and (prefetched[2] is None or
+                                       fields is not None and set(fields) <= set(prefetched[2])):
+            version, record, _ = prefetched
+            record = self.project(record, fields)
+        else:
+            self.drain()
+            (result,) = self.pool[0].call([['get', space, list(k[1]), fields]])
+            version, record = result
+        if self.reads is not None:
+            if self.reads.setdefault(k, version) != version:
+                # the harness retries with a new begin_transaction
+                self.abort_transaction()
+                raise tpcc_kv.DatabaseAbort()
+        return record
+
+    def project(self, record, fields):
+        if record is None:
+            return None
+        if fields is None:
+            return copy.deepcopy(record)
+        return {f: copy.deepcopy(record[f]) for f in fields}
+
+    def put(self, space, key, value, partial=False):
+        k = (space, tuple(key))
+        if self.writes is not None:
+            if partial and k in self.writes:
+                record, was_partial = self.writes[k]
+                record = dict(record)
+                record.update(value)
+                self.writes[k] = (record, was_partial)
+            else:
+                self.writes[k] = (copy.deepcopy(value), partial)
+            return
+        self.pending.append(['put', space, list(k[1]), value, partial])
+        if len(self.pending) >= self.batch:
+            self.flush()
+
+    def _get_warehouse(self, key):
+        return self.get('WAREHOUSE', key)
+
+    def _store_warehouse(self, key, warehouse):
+        return self.put('WAREHOUSE', key, warehouse)
+
+    def _get_district(self, key):
+        return self.get('DISTRICT', key)
+
+    def _store_district(self, key, district):
+        return self.put('DISTRICT', key, district)
+
+    def _get_customer(self, key):
+        return self.get('CUSTOMER', key)
+
+    def _store_customer(self, key, customer):
+        return self.put('CUSTOMER', key, customer)
+
+    def _store_new_order(self, key, new_order):
+        return self.put('NEW_ORDER', key, new_order)
+
+    def _get_order(self, key):
+        return self.get('ORDER', key)
+
+    def _store_order(self, key, order):
+        return self.put('ORDER', key, order)
+
+    def _get_order_line(self, key):
+        return self.get('ORDER_LINE', key)
+
+    def _store_order_line(self, key, order_line):
+        return self.put('ORDER_LINE', key, order_line)
+
+    def _get_order_lines(self, key):
+        return self.get('ORDER_LINES', key)
+
+    def _store_order_lines(self, key, order_lines):
+        return self.put('ORDER_LINES', key, order_lines)
+
+    def _get_item(self, key):
+        return self.get('ITEM', key)
+
+    def _store_item(self, key, item):
+        return self.put('ITEM', key, item)
+
+    def _get_stock(self, key):
+        return self.get('STOCK', key)
+
+    def _store_stock(self, key, stock):
+        return self.put('STOCK', key, stock)
+
+    def _store_history(self, key, history):
+        return self.put('HISTORY', key, history)
+
+    def _get_fields(self, space, key, fields):
+        return self.get(space, key, list(fields))
+
+    def _update_fields(self, space, key, values):
+        return self.put(space, key, values, partial=True)
+
+def add_arguments(parser):
+    parser.add_argument('--tcp-address', type=str, default=tpcc_kv.kvserver.DEFAULT_ADDRESS,
+            help='"tpcc-kv serve-kv" at unix:PATH or HOST:PORT')
+    parser.add_argument('--tcp-connections', type=int, default=4,
+            help='connections to spread pipelined writes across')
+    parser.add_argument('--tcp-batch', type=int, default=64,
+            help='writes per frame outside transactions')
+    parser.add_argument('--tcp-window', type=int, default=8,
+            help='frames in flight per connection before waiting for replies')
+
+def create_database(args):
+    return Database(args.tcp_address, args.tcp_connections, args.tcp_batch, args.tcp_window)
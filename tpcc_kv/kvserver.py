@@ -0,0 +1,138 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import struct
+import sys
+
+import tpcc_kv.coordinator
+
+# A small transactional key-value server for exercising the networked code
+# path of the harness on one machine ("tpcc-kv serve-kv"); db_tcp is its
+# binding.  Everything lives in one dict in one asyncio process, so the server
+# itself is never the interesting bottleneck.
+#
+# Every message is a frame: a 4-byte big-endian length and a JSON list of
+# operations.  The reply is a frame holding a JSON list with one result per
+# operation, and replies come back in the order frames were sent, so a client
+# may pipeline frames without waiting.  The operations are:
+#
+#   ["get", space, key, fields or null]       -> [version, record or null]
+#   ["put", space, key, record, partial]      -> null
+#   ["commit", [[space, key, version], ...],
+#              [[space, key, record, partial], ...]]   -> true, or false to abort
+#   ["wipe"]                                  -> null
+#
+# An operation that fails returns {"error": message} in place of its result;
+# the rest of the frame still runs.
+#
+# Transactions are optimistic: a client remembers the version of everything
+# it reads, buffers its writes, and sends both with "commit".  The server
+# applies the writes only if none of the versions changed.  A missing key has
+# version 0.  A partial record updates just the fields it carries.
+
+FRAME = struct.Struct('>I')
+DEFAULT_ADDRESS = '127.0.0.1:7379'
+
+class Store(object):
+
+    def __init__(self):
+        self.data = {}
+        self.commits = 0
+        self.aborts = 0
+
+    def get(self, space, key, fields):
+        version, record = self.data.get((space, tuple(key)), (0, None))
+        if record is not None and fields is not None:
+            record = {f: record[f] for f in fields}
+        return [version, record]
+
+    def put(self, space, key, record, partial):
+        k = (space, tuple(key))
+        version, current = self.data.get(k, (0, None))
+        if partial:
+            current = dict(current or {})
+            current.update(record)
+            record = current
+        self.data[k] = (version + 1, record)
+
+    def commit(self, reads, writes):
+        for space, key, version in reads:
+            if self.data.get((space, tuple(key)), (0, None))[0] != version:
+                self.aborts += 1
+                return False
+        for space, key, record, partial in writes:
+            self.put(space, key, record, partial)
+        self.commits += 1
+        return True
+
+    def wipe(self):
+        self.data = {}
+
+    def execute(self, op):
+        if op[0] == 'get':
+            return self.get(*op[1:])
+        if op[0] == 'put':
+            return self.put(*op[1:])
+        if op[0] == 'commit':
+            return self.commit(*op[1:])
+        if op[0] == 'wipe':
+            return self.wipe()
+        raise ValueError('unknown operation %r' % (op[0],))
+
+def encode(message):
+    data = json.dumps(message, separators=(',', ':')).encode('utf8')
+    return FRAME.pack(len(data)) + data
+
+def execute(store, op):
+    '''store.execute(op), or an error result if op is malformed or fails'''
+    try:
+        return store.execute(op)
+    except Exception as e:
+        return {'error': '%s: %s' % (type(e).__name__, e)}
+
+async def serve_connection(store, reader, writer):
+    try:
+        while True:
+            header = await reader.readexactly(FRAME.size)
+            (length,) = FRAME.unpack(header)
+            ops = json.loads((await reader.readexactly(length)).decode('utf8'))
+            writer.write(encode([execute(store, op) for op in ops]))
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(address, store):
+    sock = tpcc_kv.coordinator.listen(address)
+    handler = lambda reader, writer: serve_connection(store, reader, writer)
+    if sock.family == socket.AF_UNIX:
+        server = await asyncio.start_unix_server(handler, sock=sock)
+    else:
+        server = await asyncio.start_server(handler, sock=sock)
+    print('serve-kv: listening on %s' % address, file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main_serve(argv):
+    parser = argparse.ArgumentParser(prog='tpcc-kv serve-kv')
+    parser.add_argument('--listen', type=str, default=DEFAULT_ADDRESS,
+            help='unix:PATH or HOST:PORT')
+    args = parser.parse_args(argv)
+    store = Store()
+    try:
+        asyncio.run(serve(args.listen, store))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        family, addr = tpcc_kv.coordinator.parse_address(args.listen)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
+    print('serve-kv: %d keys, %d commits, %d aborts' %
+          (len(store.data), store.commits, store.aborts), file=sys.stderr)
+    return 0
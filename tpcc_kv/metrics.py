@@ -0,0 +1,161 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+
+# Live metrics for a run.  The transaction loop hands each completed
+# transaction to MetricsReporter.record, which is a single deque append; a
+# background thread drains the deque every interval and writes a snapshot of
+# throughput, per-series latency percentiles, abort rate and in-flight
+# transactions to a sink.
+
+def percentile(ordered, p):
+    if not ordered:
+        return 0.0
+    idx = int(round(p * (len(ordered) - 1)))
+    return ordered[idx]
+
+class StderrSink(object):
+
+    def write(self, snap):
+        parts = ['%.1fs' % snap['elapsed'],
+                 '%.1f txn/s' % snap['throughput'],
+                 'aborts %.1f%%' % (snap['abort_rate'] * 100),
+                 'in-flight %d' % snap['inflight']]
+        for name, s in sorted(snap['series'].items()):
+            parts.append('%s n=%d p50=%.1fms p99=%.1fms' % (name, s['count'], s['p50'], s['p99']))
+        print('metrics: ' + ' | '.join(parts), file=sys.stderr)
+
+    def close(self):
+        pass
+
+class JSONLinesSink(object):
+
+    def __init__(self, path):
+        self.f = open(path, 'a')
+
+    def write(self, snap):
+        self.f.write(json.dumps(snap, sort_keys=True) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class PrometheusSink(object):
+    '''node_exporter textfile collector format; the file is replaced
+    atomically on every snapshot'''
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, snap):
+        lines = []
+        def gauge(name, value, labels=''):
+            lines.append('tpcc_kv_%s%s %s' % (name, labels, repr(float(value))))
+        lines.append('# TYPE tpcc_kv_throughput gauge')
+        gauge('throughput', snap['throughput'])
+        lines.append('# TYPE tpcc_kv_abort_rate gauge')
+        gauge('abort_rate', snap['abort_rate'])
+        lines.append('# TYPE tpcc_kv_inflight gauge')
+        gauge('inflight', snap['inflight'])
+        lines.append('# TYPE tpcc_kv_completed_total counter')
+        gauge('completed_total', snap['completed'])
+        lines.append('# TYPE tpcc_kv_latency_ms gauge')
+        for name, s in sorted(snap['series'].items()):
+            gauge('latency_ms', s['p50'], '{series="%s",quantile="0.5"}' % name)
+            gauge('latency_ms', s['p99'], '{series="%s",quantile="0.99"}' % name)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.path)
+
+    def close(self):
+        pass
+
+def create_sink(fmt, path):
+    if fmt == 'stderr':
+        return StderrSink()
+    if path is None:
+        raise ValueError('metrics format %r needs an output path' % fmt)
+    if fmt == 'jsonl':
+        return JSONLinesSink(path)
+    if fmt == 'prometheus':
+        return PrometheusSink(path)
+    raise ValueError('unknown metrics format %r' % fmt)
+
+class MetricsReporter(object):
+
+    def __init__(self, interval, sink):
+        self.interval = interval
+        self.sink = sink
+        self.pending = collections.deque()
+        self.started = 0
+        self.completed = 0
+        self.t0 = time.time()
+        self.last = self.t0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.loop, name='metrics', daemon=True)
+
+    # Called from the transaction loop; keep these cheap.
+
+    def begin(self):
+        self.started += 1
+
+    def record(self, series, latency_ms, aborts):
+        self.pending.append((series, latency_ms, aborts))
+
+    # Called from the reporter thread.
+
+    def loop(self):
+        while not self.stopped.wait(self.interval):
+            self.emit()
+
+    def emit(self):
+        now = time.time()
+        latencies = collections.defaultdict(list)
+        aborts = 0
+        count = 0
+        while True:
+            try:
+                series, latency_ms, a = self.pending.popleft()
+            except IndexError:
+                break
+            latencies[series].append(latency_ms)
+            aborts += a
+            count += 1
+        self.completed += count
+        elapsed = max(now - self.last, 1e-9)
+        self.last = now
+        snap = {'time': now,
+                'elapsed': now - self.t0,
+                'interval': elapsed,
+                'completed': self.completed,
+                'throughput': count / elapsed,
+                'aborts': aborts,
+                'abort_rate': aborts / (aborts + count) if aborts + count else 0.0,
+                'inflight': self.started - self.completed - len(self.pending),
+                'series': {}}
+        for series, lat in latencies.items():
+            lat.sort()
+            snap['series'][series] = {'count': len(lat),
+                                      'p50': percentile(lat, 0.50),
+                                      'p99': percentile(lat, 0.99)}
+        self.sink.write(snap)
+
+    def start(self):
+        # run may wait on the coordinator after building the reporter; the
+        # first interval starts now
+        self.t0 = time.time()
+        self.last = self.t0
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.emit()
+        self.sink.close()
@@ -0,0 +1,165 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import argparse
+import collections
+import cProfile
+import glob
+import os
+import pstats
+import signal
+import sys
+
+# Per-process profiling for tpcc-kv actions.  Every process started with
+# --profile DIR writes DIR/<action>-<pid>.prof (cProfile) or
+# DIR/<action>-<pid>.folded (sampling, one collapsed stack per line as
+# flamegraph.pl expects).  "tpcc-kv profile-merge DIR" folds all of them into
+# a single merged.prof and merged.folded.  cProfile keeps only caller/callee
+# pairs, not stacks, so for cProfile runs the merge also writes
+# merged-cprofile.folded, stacks reconstructed from those pairs; the sampling
+# profiler's stacks are the real ones.
+#
+# cProfile is exact but slows Python code down considerably.  The sampling
+# profiler takes a stack every interval from a timer signal: the cpu clock
+# shows where the harness and binding burn CPU; the wall clock also charges
+# time spent blocked waiting on the store.
+
+class CProfileProfiler(object):
+
+    SUFFIX = '.prof'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self, prefix):
+        self.profile.disable()
+        self.profile.dump_stats(prefix + self.SUFFIX)
+
+class SamplingProfiler(object):
+
+    SUFFIX = '.folded'
+
+    def __init__(self, interval, clock):
+        self.interval = interval
+        if clock == 'cpu':
+            self.timer, self.signum = signal.ITIMER_PROF, signal.SIGPROF
+        else:
+            self.timer, self.signum = signal.ITIMER_REAL, signal.SIGALRM
+        self.stacks = collections.Counter()
+        self.previous = None
+
+    def sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('%s (%s:%d)' % (code.co_name,
+                os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        self.stacks[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self.previous = signal.signal(self.signum, self.sample)
+        signal.setitimer(self.timer, self.interval, self.interval)
+
+    def stop(self, prefix):
+        signal.setitimer(self.timer, 0, 0)
+        signal.signal(self.signum, self.previous)
+        write_folded(prefix + self.SUFFIX, self.stacks)
+
+def write_folded(path, stacks):
+    with open(path, 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write('%s %d\n' % (stack, count))
+
+def read_folded(path, stacks):
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+
+def frame_label(func):
+    '''the sampler's frame label for a pstats (file, line, name) key'''
+    filename, line, name = func
+    return '%s (%s:%d)' % (name, os.path.basename(filename), line)
+
+def folded_from_pstats(stats, max_depth=64, min_us=1):
+    '''approximate collapsed stacks from cProfile's caller/callee edges.
+    cProfile does not keep whole stacks, so each function's own time is
+    spread over its callers in proportion to the time each call edge
+    accounts for, all the way up to a root; counts are microseconds'''
+    stacks = collections.Counter()
+    def walk(func, weight, path):
+        callers = stats.stats[func][4]
+        live = {c: edge[3] for c, edge in callers.items() if c not in path and c in stats.stats}
+        total = sum(live.values())
+        if not live or total <= 0 or len(path) >= max_depth:
+            stacks[';'.join(frame_label(f) for f in reversed(path))] += int(round(weight))
+            return
+        for caller, ct in live.items():
+            share = weight * ct / total
+            if share >= min_us:
+                walk(caller, share, path + (caller,))
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if tt * 1e6 >= min_us:
+            walk(func, tt * 1e6, (func,))
+    del stacks['']
+    return stacks
+
+def add_arguments(parser):
+    parser.add_argument('--profile', type=str, default=None, metavar='DIR',
+            help='write a profile of this process into DIR')
+    parser.add_argument('--profile-mode', choices=('cprofile', 'sample'), default='cprofile')
+    parser.add_argument('--profile-interval', type=float, default=5.0,
+            help='milliseconds between samples in sample mode')
+    parser.add_argument('--profile-clock', choices=('cpu', 'wall'), default='wall',
+            help='clock that drives sampling; wall includes time blocked on the store')
+
+def create_profiler(args):
+    if args.profile is None:
+        return None
+    os.makedirs(args.profile, exist_ok=True)
+    if args.profile_mode == 'sample':
+        return SamplingProfiler(args.profile_interval / 1000., args.profile_clock)
+    return CProfileProfiler()
+
+def output_prefix(args, action):
+    return os.path.join(args.profile, '%s-%d' % (action, os.getpid()))
+
+def main_merge(argv):
+    parser = argparse.ArgumentParser(prog='tpcc-kv profile-merge')
+    parser.add_argument('directory', type=str)
+    parser.add_argument('--output', type=str, default=None,
+            help='prefix for the merged files (default: DIR/merged)')
+    parser.add_argument('--top', type=int, default=25,
+            help='functions to print from the merged cProfile data')
+    args = parser.parse_args(argv)
+    output = args.output or os.path.join(args.directory, 'merged')
+    merged = output + CProfileProfiler.SUFFIX
+    profiles = [p for p in sorted(glob.glob(os.path.join(args.directory, '*' + CProfileProfiler.SUFFIX)))
+                if p != merged]
+    merged_folded = output + SamplingProfiler.SUFFIX
+    cprofile_folded = output + '-cprofile' + SamplingProfiler.SUFFIX
+    folded = [p for p in sorted(glob.glob(os.path.join(args.directory, '*' + SamplingProfiler.SUFFIX)))
+              if p not in (merged_folded, cprofile_folded)]
+    if not profiles and not folded:
+        print('no profiles in %r' % args.directory, file=sys.stderr)
+        return -1
+    if profiles:
+        stats = pstats.Stats(*profiles, stream=sys.stdout)
+        stats.dump_stats(merged)
+        print('merged %d cProfile profiles into %s' % (len(profiles), merged))
+        stats.sort_stats('cumulative').print_stats(args.top)
+        write_folded(cprofile_folded, folded_from_pstats(stats))
+        print('wrote collapsed stacks (microseconds, reconstructed from call edges) to %s' % cprofile_folded)
+    if folded:
+        stacks = collections.Counter()
+        for path in folded:
+            read_folded(path, stacks)
+        write_folded(merged_folded, stacks)
+        print('merged %d sampled profiles (%d samples) into %s' %
+              (len(folded), sum(stacks.values()), merged_folded))
+    return 0
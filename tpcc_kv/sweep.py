@@ -0,0 +1,216 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import argparse
+import collections
+import io
+import json
+import math
+import os
+import subprocess
+import sys
+import threading
+
+import tpcc_kv.coordinator
+
+# "tpcc-kv sweep" looks for the knee of the throughput/latency curve.  It runs
+# the same "tpcc-kv run" at increasing numbers of client processes, each level
+# started and stopped together through an in-process coordinator for
+# --duration seconds.  Every client writes a --summary with its latency
+# histogram; the sweep merges them and prints one row per level.  It stops
+# once a level adds less than --plateau-pct throughput over the best level so
+# far, or its p99 passes --p99-ms.  With --hold it then runs the best level
+# for that many seconds more, e.g. to keep the store loaded while it is being
+# observed.
+#
+#   tpcc-kv sweep --levels 1,2,4,8,16 --duration 20 --p99-ms 50 shm -- \
+#       --warehouses 10
+#
+# Sweep options come before the binding; everything after it goes to run.
+
+class LatencyHistogram(object):
+    '''latencies in log-spaced buckets about 1% wide, so that the
+    histograms of many processes merge into exact-enough percentiles'''
+
+    BASE = 1.01
+
+    def __init__(self, buckets=None):
+        self.buckets = collections.Counter()
+        for bucket, count in (buckets or {}).items():
+            self.buckets[int(bucket)] += count
+
+    def add(self, latency_ms):
+        self.buckets[int(math.floor(math.log(max(latency_ms, 1e-3), self.BASE)))] += 1
+
+    def merge(self, other):
+        self.buckets.update(other.buckets)
+
+    def count(self):
+        return sum(self.buckets.values())
+
+    def percentile(self, p):
+        total = self.count()
+        if total == 0:
+            return 0.0
+        rank = p * (total - 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                return self.BASE ** (bucket + 0.5)
+        return self.BASE ** (max(self.buckets) + 0.5)
+
+    def to_json(self):
+        return {str(bucket): count for bucket, count in self.buckets.items()}
+
+class RunSummary(object):
+    '''what "tpcc-kv run --summary PATH" writes; fed like MetricsReporter'''
+
+    def __init__(self):
+        self.histogram = LatencyHistogram()
+        self.completed = 0
+        self.aborts = 0
+
+    def record(self, series, latency_ms, aborts):
+        self.histogram.add(latency_ms)
+        self.completed += 1
+        self.aborts += aborts
+
+    def write(self, path, started, finished):
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'completed': self.completed, 'aborts': self.aborts,
+                       'started': started, 'finished': finished,
+                       'histogram': self.histogram.to_json()}, f)
+        os.replace(tmp, path)
+
+def parse_levels(s):
+    levels = [int(x) for x in s.split(',')]
+    if not levels or min(levels) < 1 or levels != sorted(levels):
+        raise argparse.ArgumentTypeError('expected increasing client counts, e.g. 1,2,4,8')
+    return levels
+
+def geometric_levels(start, factor, maximum):
+    level = start
+    while level <= maximum:
+        yield level
+        level = max(level + 1, int(round(level * factor)))
+
+class Level(object):
+
+    def __init__(self, clients, reports, summaries):
+        self.clients = clients
+        self.histogram = LatencyHistogram()
+        self.completed = 0
+        self.aborts = 0
+        for summary in summaries:
+            self.histogram.merge(LatencyHistogram(summary['histogram']))
+            self.completed += summary['completed']
+            self.aborts += summary['aborts']
+        elapsed = 0.
+        if reports:
+            elapsed = max(r['finished'] for r in reports) - min(r['started'] for r in reports)
+        self.throughput = self.completed / elapsed if elapsed > 0 else 0.
+        self.p50 = self.histogram.percentile(0.50)
+        self.p99 = self.histogram.percentile(0.99)
+        attempts = self.completed + self.aborts
+        self.abort_rate = self.aborts / attempts if attempts else 0.
+
+HEADER = '%8s %12s %10s %10s %8s' % ('clients', 'txn/s', 'p50 ms', 'p99 ms', 'aborts')
+
+def format_level(level, note=''):
+    return '%8d %12.1f %10.2f %10.2f %7.2f%% %s' % (level.clients, level.throughput,
+            level.p50, level.p99, level.abort_rate * 100, note)
+
+def run_level(args, clients, duration, tag):
+    '''run clients processes for duration seconds; returns a Level'''
+    address = 'unix:' + os.path.join(args.output, 'sweep.sock')
+    env = dict(os.environ)
+    package_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(p for p in (package_root, env.get('PYTHONPATH')) if p)
+    summaries = [os.path.join(args.output, '%s-%d.summary' % (tag, i)) for i in range(clients)]
+    result = {}
+    def coordinate():
+        result['reports'] = tpcc_kv.coordinator.coordinate(address, clients,
+                args.start_delay, duration, out=io.StringIO())
+    coordinator = threading.Thread(target=coordinate, name='coordinator', daemon=True)
+    coordinator.start()
+    procs = []
+    for i in range(clients):
+        argv = [sys.executable, '-m', 'tpcc_kv', 'run', args.binding,
+                '--operations', '0', '--coordinator', address,
+                '--output', os.path.join(args.output, '%s-%d.dat' % (tag, i)),
+                '--summary', summaries[i]] + args.run_args
+        procs.append(subprocess.Popen(argv, env=env))
+    try:
+        while coordinator.is_alive():
+            coordinator.join(0.5)
+            failed = [p for p in procs if p.poll() not in (None, 0)]
+            if failed:
+                raise RuntimeError('a client exited with status %d' % failed[0].returncode)
+        for p in procs:
+            if p.wait() != 0:
+                raise RuntimeError('a client exited with status %d' % p.returncode)
+    finally:
+        for p in procs:
+            if p.poll() is None:
+                p.terminate()
+                p.wait()
+    loaded = []
+    for path in summaries:
+        with open(path) as f:
+            loaded.append(json.load(f))
+    return Level(clients, result.get('reports', []), loaded)
+
+def main_sweep(argv):
+    parser = argparse.ArgumentParser(prog='tpcc-kv sweep',
+            usage='%(prog)s [options] binding [-- run arguments]')
+    parser.add_argument('binding', type=str)
+    parser.add_argument('run_args', nargs=argparse.REMAINDER,
+            help='passed to every "tpcc-kv run"')
+    parser.add_argument('--levels', type=parse_levels, default=None,
+            help='client counts to try, e.g. 1,2,4,8 (default: --start growing by --factor up to --max-clients)')
+    parser.add_argument('--start', type=int, default=1)
+    parser.add_argument('--factor', type=float, default=2.0)
+    parser.add_argument('--max-clients', type=int, default=256)
+    parser.add_argument('--duration', type=float, default=10.0,
+            help='seconds each level runs')
+    parser.add_argument('--start-delay', type=float, default=1.0,
+            help='seconds between the last client registering and the start')
+    parser.add_argument('--plateau-pct', type=float, default=5.0,
+            help='stop when a level improves on the best throughput by less than this')
+    parser.add_argument('--p99-ms', type=float, default=None,
+            help='stop when p99 latency passes this')
+    parser.add_argument('--hold', type=float, default=0.,
+            help='then run the best level for this many seconds')
+    parser.add_argument('--output', type=str, default='sweep',
+            help='directory for the clients\' data files and summaries')
+    args = parser.parse_args(argv)
+    if args.run_args[:1] == ['--']:
+        args.run_args = args.run_args[1:]
+    os.makedirs(args.output, exist_ok=True)
+    levels = args.levels or list(geometric_levels(args.start, args.factor, args.max_clients))
+    print(HEADER)
+    best = None
+    for clients in levels:
+        level = run_level(args, clients, args.duration, 'level-%d' % clients)
+        note = ''
+        stop = False
+        if args.p99_ms is not None and level.p99 > args.p99_ms:
+            note, stop = 'p99 over %gms' % args.p99_ms, True
+        elif best is not None and level.throughput < best.throughput * (1 + args.plateau_pct / 100.):
+            note, stop = 'plateau', True
+        if best is None or (level.throughput > best.throughput and
+                            (args.p99_ms is None or level.p99 <= args.p99_ms)):
+            best = level
+        print(format_level(level, note))
+        sys.stdout.flush()
+        if stop:
+            break
+    if best is None:
+        return -1
+    print('best: %d clients, %.1f txn/s, p99 %.2fms' % (best.clients, best.throughput, best.p99))
+    if args.hold > 0:
+        level = run_level(args, best.clients, args.hold, 'hold-%d' % best.clients)
+        print(format_level(level, 'held %gs' % args.hold))
+    return 0
@@ -0,0 +1,226 @@
+# Copyright (c) 2017
+# All rights reserved.
+
+import argparse
+import gc
+import importlib
+import json
+import os
+import select
+import signal
+import socket
+import sys
+import traceback
+
+import tpcc_kv
+import tpcc_kv.coordinator
+
+# A prefork server that takes interpreter start-up off the clients' critical
+# path.  "tpcc-kv zygote" imports the harness and the named bindings once,
+# then listens on a socket.  "tpcc-kv spawn" asks it to fork one child per
+# client; each child runs tpcc_kv.main with its own arguments in the
+# spawner's working directory and exits.  Children share the zygote's
+# imported modules copy-on-write.  Connections to the store cannot be shared
+# across fork, so every child still opens its own in create_database.
+#
+# Over a Unix socket the spawner passes its stdin, stdout and stderr along
+# with the request, so the children's output goes where the spawner's would.
+#
+# The protocol is one JSON object per line, like the coordinator's:
+#   spawn  -> {"op": "spawn", "argvs": [[...], ...], "cwd": ...}
+#   zygote -> {"op": "spawned", "pids": [...]}
+#   zygote -> {"op": "exited", "pid": ..., "status": ...}   (one per child)
+
+DEFAULT_ADDRESS = 'unix:tpcc-kv-zygote.sock'
+MAX_REQUEST = 1 << 20
+
+def run_child(argv, cwd, fds):
+    '''the body of a forked child; never returns'''
+    status = 1
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        sys.stdout.flush()
+        sys.stderr.flush()
+        for target, fd in zip((0, 1, 2), fds):
+            os.dup2(fd, target)
+        for fd in fds:
+            os.close(fd)
+        os.chdir(cwd)
+        status = tpcc_kv.main(argv) or 0
+    except SystemExit as e:
+        status = e.code if isinstance(e.code, int) else 1
+    except BaseException:
+        traceback.print_exc()
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status & 0xff)
+
+class Zygote(object):
+
+    def __init__(self, address, out=sys.stderr):
+        self.address = address
+        self.out = out
+        self.server = tpcc_kv.coordinator.listen(address)
+        self.channels = []
+        self.children = {}
+        # stdio fds that came with the start of a spawn request, kept until
+        # the rest of it has arrived
+        self.fds = {}
+
+    def close(self):
+        self.server.close()
+        for channel in self.channels:
+            channel.close()
+        for held in self.fds.values():
+            for fd in held:
+                os.close(fd)
+        family, addr = tpcc_kv.coordinator.parse_address(self.address)
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
+
+    def serve(self):
+        while True:
+            readable, _, _ = select.select([self.server] + self.channels, [], [], 0.1)
+            for r in readable:
+                if r is self.server:
+                    sock, _ = self.server.accept()
+                    self.channels.append(tpcc_kv.coordinator.Channel(sock))
+                else:
+                    self.receive(r)
+            self.reap()
+
+    def receive(self, channel):
+        if channel.sock.family == socket.AF_UNIX:
+            data, fds, _, _ = socket.recv_fds(channel.sock, MAX_REQUEST, 3)
+            self.fds.setdefault(channel, []).extend(fds)
+        else:
+            data = channel.sock.recv(MAX_REQUEST)
+        if not data:
+            self.drop(channel)
+            return
+        channel.buf += data
+        while channel.pending():
+            msg = channel.recv()
+            if msg.get('op') == 'spawn':
+                fds = self.fds.pop(channel, [])
+                try:
+                    self.spawn(channel, msg, fds)
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+
+    def spawn(self, channel, msg, fds):
+        pids = []
+        for argv in msg['argvs']:
+            pid = os.fork()
+            if pid == 0:
+                self.server.close()
+                for c in self.channels:
+                    c.close()
+                for held in self.fds.values():
+                    for fd in held:
+                        os.close(fd)
+                run_child(argv, msg.get('cwd', '/'), fds)
+            self.children[pid] = channel
+            pids.append(pid)
+        self.send(channel, {'op': 'spawned', 'pids': pids})
+        print('zygote: spawned %d children' % len(pids), file=self.out)
+
+    def reap(self):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                break
+            channel = self.children.pop(pid, None)
+            if channel is not None:
+                self.send(channel, {'op': 'exited', 'pid': pid,
+                                    'status': os.waitstatus_to_exitcode(status)})
+
+    def send(self, channel, msg):
+        if channel not in self.channels:
+            return
+        try:
+            channel.send(msg)
+        except OSError:
+            self.drop(channel)
+
+    def drop(self, channel):
+        # children outlive the spawner that asked for them
+        if channel in self.channels:
+            self.channels.remove(channel)
+            channel.close()
+        for fd in self.fds.pop(channel, []):
+            os.close(fd)
+
+def main_zygote(argv):
+    parser = argparse.ArgumentParser(prog='tpcc-kv zygote')
+    parser.add_argument('bindings', nargs='*', type=str,
+            help='bindings to import before forking')
+    parser.add_argument('--listen', type=str, default=DEFAULT_ADDRESS,
+            help='unix:PATH or HOST:PORT')
+    args = parser.parse_args(argv)
+    for binding in args.bindings:
+        importlib.import_module(tpcc_kv.binding_module(binding))
+    # keep the collector from touching, and so copying, every page of the
+    # preloaded modules in every child
+    gc.freeze()
+    # scripts stop a background zygote with SIGTERM; clean up as for ^C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    zygote = Zygote(args.listen)
+    print('zygote: ready on %s' % args.listen, file=sys.stderr)
+    try:
+        zygote.serve()
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        zygote.close()
+    return 0
+
+def main_spawn(argv):
+    parser = argparse.ArgumentParser(prog='tpcc-kv spawn',
+            usage='%(prog)s [options] -- action binding [arguments]')
+    parser.add_argument('--zygote', type=str, default=DEFAULT_ADDRESS,
+            help='"tpcc-kv zygote" at unix:PATH or HOST:PORT')
+    parser.add_argument('--count', type=int, default=1,
+            help='children to start; "{i}" in the arguments becomes 0..count-1')
+    parser.add_argument('--detach', action='store_true', default=False,
+            help='return once the children have started instead of when they exit')
+    parser.add_argument('argv', nargs=argparse.REMAINDER)
+    args = parser.parse_args(argv)
+    if args.argv[:1] == ['--']:
+        args.argv = args.argv[1:]
+    if len(args.argv) < 2:
+        parser.error('expected an action and a binding')
+    argvs = [[a.replace('{i}', str(i)) for a in args.argv] for i in range(args.count)]
+    sock = tpcc_kv.coordinator.connect(args.zygote)
+    channel = tpcc_kv.coordinator.Channel(sock)
+    request = (json.dumps({'op': 'spawn', 'argvs': argvs, 'cwd': os.getcwd()}) + '\n').encode('utf8')
+    if sock.family == socket.AF_UNIX:
+        socket.send_fds(sock, [request], [0, 1, 2])
+    else:
+        sock.sendall(request)
+    msg = channel.recv()
+    assert msg is not None and msg['op'] == 'spawned', msg
+    pids = set(msg['pids'])
+    if args.detach:
+        print(' '.join(str(pid) for pid in sorted(pids)))
+        channel.close()
+        return 0
+    failed = 0
+    while pids:
+        msg = channel.recv()
+        if msg is None:
+            print('spawn: lost the zygote with %d children running' % len(pids), file=sys.stderr)
+            return -1
+        if msg['op'] == 'exited':
+            pids.discard(msg['pid'])
+            if msg['status'] != 0:
+                failed += 1
+    channel.close()
+    if failed:
+        print('spawn: %d of %d children failed' % (failed, args.count), file=sys.stderr)
+        return 1
+    return 0